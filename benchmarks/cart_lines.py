@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Compare cart storage: client-supplied dict lines vs slotted CartLine.
+
+Measures memory per stored line with tracemalloc, then times what the server
+does with a cart: generating a bill and answering /api/cart. Dict carts were
+used as stored; CartLine carts go through resolve_cart() first, which builds
+a dict per line from the catalog, so its cost is reported on its own too.
+
+    python benchmarks/cart_lines.py [lines]
+"""
+
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from enhanced_billing import CartLine, CrackerBillingHandler  # noqa: E402
+
+inventory = CrackerBillingHandler.inventory
+names = list(inventory)
+customer = {"name": "Ramesh Kumar", "phone": "9876543210", "address": "Sivakasi"}
+
+
+def dict_lines(count):
+    # What the page used to post to /api/add-item and the server stored as-is
+    lines = []
+    for i in range(count):
+        name = names[i % len(names)]
+        details = inventory[name]
+        lines.append({"product": name, "price": details["price"], "qty": 3, "gst": details["gst"]})
+    return lines
+
+
+def cart_lines(count):
+    return [CartLine(inventory[names[i % len(names)]]["id"], 3) for i in range(count)]
+
+
+def bytes_per_line(build, count):
+    tracemalloc.start()
+    lines = build(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del lines
+    return current / count
+
+
+def best_ms(action, repeat=10):
+    return min(timeit.repeat(action, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    handler = CrackerBillingHandler.__new__(CrackerBillingHandler)
+    print(f"{count} cart lines")
+
+    print("memory per stored line:")
+    for label, build in (("dict", dict_lines), ("CartLine", cart_lines)):
+        print(f"{label:>10}: {bytes_per_line(build, count):6.1f} bytes")
+
+    old = dict_lines(count)
+    CrackerBillingHandler.cart = cart_lines(count)
+    try:
+        # Same bill either way; fixed bill_no and timestamp so the texts compare
+        args = ('RPP1', '2025-10-01 10:00:00')
+        assert handler.generate_bill(customer, old, *args) == \
+            handler.generate_bill(customer, handler.resolve_cart(), *args)
+
+        print("generate_bill:")
+        print(f"{'dict':>10}: {best_ms(lambda: handler.generate_bill(customer, old)):8.2f}ms")
+        print(f"{'CartLine':>10}: "
+              f"{best_ms(lambda: handler.generate_bill(customer, handler.resolve_cart())):8.2f}ms")
+        print(f"{'resolve':>10}: {best_ms(handler.resolve_cart):8.2f}ms of that")
+
+        print("/api/cart body:")
+        print(f"{'dict':>10}: {best_ms(lambda: json.dumps(old)):8.2f}ms")
+        print(f"{'CartLine':>10}: {best_ms(lambda: json.dumps(handler.resolve_cart())):8.2f}ms")
+    finally:
+        CrackerBillingHandler.cart = []
+
+
+if __name__ == "__main__":
+    main()
@@ -3,209 +3,1197 @@
 Enhanced Cracker Shop Billing with GST and Database
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import time
+
+# Process start, taken before the other imports so cold start time includes them
+BOOT_TIME = time.monotonic()
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import json
 import datetime
 import sqlite3
 import os
+import threading
+import queue
+from contextlib import contextmanager
+from decimal import Decimal
+import cProfile
+import pstats
+import random
+import math
+import re
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+# Ordered schema migrations: (version, description, {dialect: [statements]}).
+# Applied versions are recorded in schema_version and skipped on later starts.
+MIGRATIONS = [
+    (1, 'create bills and bill_items', {
+        'postgres': [
+            '''
+            CREATE TABLE IF NOT EXISTS bills (
+                id SERIAL PRIMARY KEY,
+                bill_no VARCHAR(50) UNIQUE,
+                date TIMESTAMP,
+                customer_name VARCHAR(255),
+                customer_phone VARCHAR(20),
+                customer_address TEXT,
+                subtotal DECIMAL(10,2),
+                cgst DECIMAL(10,2),
+                sgst DECIMAL(10,2),
+                total_amount DECIMAL(10,2),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS bill_items (
+                id SERIAL PRIMARY KEY,
+                bill_no VARCHAR(50),
+                product_name VARCHAR(255),
+                quantity INTEGER,
+                unit_price DECIMAL(10,2),
+                total_price DECIMAL(10,2),
+                FOREIGN KEY (bill_no) REFERENCES bills (bill_no)
+            )
+            ''',
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS bills (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bill_no TEXT UNIQUE,
+                date TEXT,
+                customer_name TEXT,
+                customer_phone TEXT,
+                customer_address TEXT,
+                subtotal REAL,
+                cgst REAL,
+                sgst REAL,
+                total_amount REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS bill_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bill_no TEXT,
+                product_name TEXT,
+                quantity INTEGER,
+                unit_price REAL,
+                total_price REAL,
+                FOREIGN KEY (bill_no) REFERENCES bills (bill_no)
+            )
+            ''',
+        ],
+    }),
+    (2, 'index bill history lookups', {
+        'postgres': [
+            'CREATE INDEX IF NOT EXISTS idx_bills_created_at ON bills (created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_bill_items_bill_no ON bill_items (bill_no)',
+        ],
+        'sqlite': [
+            'CREATE INDEX IF NOT EXISTS idx_bills_created_at ON bills (created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_bill_items_bill_no ON bill_items (bill_no)',
+        ],
+    }),
+    (3, 'full-text search over bills', {
+        'postgres': [
+            'ALTER TABLE bills ADD COLUMN IF NOT EXISTS search tsvector',
+            '''
+            UPDATE bills SET search = to_tsvector('simple', concat_ws(' ',
+                bill_no, customer_name, customer_phone, customer_address,
+                (SELECT string_agg(product_name, ' ') FROM bill_items i
+                 WHERE i.bill_no = bills.bill_no)))
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_bills_search ON bills USING GIN (search)',
+        ],
+        'sqlite': [
+            # Trigram tokens let partial phone and bill numbers match anywhere
+            '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS bills_fts USING fts5(
+                bill_no, customer_name, customer_phone, customer_address, products,
+                tokenize = 'trigram'
+            )
+            ''',
+            '''
+            INSERT INTO bills_fts (rowid, bill_no, customer_name, customer_phone,
+                                   customer_address, products)
+            SELECT id, bill_no, customer_name, customer_phone, customer_address,
+                   (SELECT group_concat(product_name, ' ') FROM bill_items i
+                    WHERE i.bill_no = bills.bill_no)
+            FROM bills
+            ''',
+        ],
+    }),
+    (4, 'client bill ids for offline sync', {
+        'postgres': [
+            'ALTER TABLE bills ADD COLUMN IF NOT EXISTS client_id VARCHAR(64)',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_client_id ON bills (client_id)',
+        ],
+        'sqlite': [
+            'ALTER TABLE bills ADD COLUMN client_id TEXT',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_bills_client_id ON bills (client_id)',
+        ],
+    }),
+]
+
+SQLITE_PATH = 'billing_records.db'
+
+# Bill numbers and timestamps accepted from offline clients
+BILL_NO_PATTERN = re.compile(r'^RPP[A-Za-z0-9-]{1,40}$')
+SYNC_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+
+# Customer fields as (key, default, max length); lengths fit the PostgreSQL columns
+CUSTOMER_FIELDS = (
+    ('name', 'Walk-in Customer', 255),
+    ('phone', 'N/A', 20),
+    ('address', 'N/A', 500),
+)
+
+class DatabaseUnavailable(Exception):
+    pass
+
+class SQLiteDialect:
+    """SQL written with ? placeholders runs unchanged on SQLite."""
+    name = 'sqlite'
+    label = 'SQLite'
+    
+    def sql(self, query):
+        return query
+    
+    def connect(self):
+        return sqlite3.connect(SQLITE_PATH)
+    
+    def begin(self, conn):
+        # sqlite3 only opens a transaction before DML, and a SAVEPOINT issued
+        # outside one would commit on RELEASE. IMMEDIATE takes the write lock
+        # up front (waiting out the busy timeout), since a deferred transaction
+        # that has already read cannot upgrade when another writer got there first.
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+    
+    @property
+    def integrity_error(self):
+        return sqlite3.IntegrityError
+    
+    def insert_returning(self, cursor, query, params, column='id'):
+        # query is written with ? placeholders, like everything passed to sql()
+        cursor.execute(query, params)
+        return cursor.lastrowid
+    
+    def insert_many(self, cursor, table, columns, rows):
+        placeholders = ', '.join('?' for _ in columns)
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows
+        )
+    
+    def execute_prepared(self, cursor, prepared, name, query, params):
+        # sqlite3 already keeps a per-connection cache of compiled statements
+        cursor.execute(query, params)
+    
+    def to_python(self, value):
+        return value
+    
+    def stream_cursor(self, conn):
+        return conn.cursor()
+    
+    search_query = '''
+        SELECT b.bill_no, b.date, b.customer_name, b.customer_phone, b.total_amount
+        FROM bills_fts JOIN bills b ON b.id = bills_fts.rowid
+        WHERE bills_fts MATCH ?
+        ORDER BY bm25(bills_fts), b.id DESC
+        LIMIT ? OFFSET ?
+    '''
+    
+    def search_terms(self, text):
+        # Each word becomes a quoted phrase; FTS5 ANDs them together
+        return ' '.join('"' + word.replace('"', '""') + '"' for word in text.split())
+    
+    def index_bill(self, cursor, bill_id, bill_data, items):
+        cursor.execute('''
+            INSERT INTO bills_fts (rowid, bill_no, customer_name, customer_phone,
+                                   customer_address, products)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            bill_id, bill_data['bill_no'], bill_data['customer_name'],
+            bill_data['customer_phone'], bill_data['customer_address'],
+            ' '.join(item['product'] for item in items)
+        ))
+
+class PostgresDialect(SQLiteDialect):
+    """Translates ? placeholders, uses RETURNING, execute_values and PREPARE."""
+    name = 'postgres'
+    label = 'PostgreSQL'
+    
+    def __init__(self, db_url):
+        self.db_url = db_url
+        self._driver = None
+    
+    def _load_driver(self):
+        # Import psycopg2 once, on first PostgreSQL connection
+        if self._driver is None:
+            import psycopg2
+            import psycopg2.extras
+            self._driver = psycopg2
+        return self._driver
+    
+    def sql(self, query):
+        return query.replace('%', '%%').replace('?', '%s')
+    
+    def numbered(self, query):
+        # PREPARE takes $1, $2, ... instead of driver placeholders
+        parts = query.split('?')
+        return parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+    
+    def connect(self):
+        return self._load_driver().connect(self.db_url, connect_timeout=5)
+    
+    def begin(self, conn):
+        # psycopg2 opens a transaction on the first statement
+        pass
+    
+    @property
+    def integrity_error(self):
+        return self._load_driver().IntegrityError
+    
+    def insert_returning(self, cursor, query, params, column='id'):
+        cursor.execute(self.sql(query) + f' RETURNING {column}', params)
+        return cursor.fetchone()[0]
+    
+    def insert_many(self, cursor, table, columns, rows):
+        self._load_driver().extras.execute_values(
+            cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s", rows
+        )
+    
+    def execute_prepared(self, cursor, prepared, name, query, params):
+        if name not in prepared:
+            cursor.execute(f'PREPARE {name} AS {self.numbered(query)}')
+            prepared.add(name)
+        placeholders = ', '.join('%s' for _ in params)
+        cursor.execute(f'EXECUTE {name} ({placeholders})' if params else f'EXECUTE {name}', params)
+    
+    search_query = '''
+        SELECT bill_no, date, customer_name, customer_phone, total_amount
+        FROM bills, to_tsquery('simple', ?) query
+        WHERE search @@ query
+        ORDER BY ts_rank(search, query) DESC, id DESC
+        LIMIT ? OFFSET ?
+    '''
+    
+    def search_terms(self, text):
+        # Prefix-match every word: "98765" finds 9876543210
+        words = [re.sub(r'\W', '', word) for word in text.split()]
+        return ' & '.join(f'{word}:*' for word in words if word)
+    
+    def index_bill(self, cursor, bill_id, bill_data, items):
+        document = ' '.join([
+            bill_data['bill_no'], bill_data['customer_name'], bill_data['customer_phone'],
+            bill_data['customer_address']
+        ] + [item['product'] for item in items])
+        cursor.execute(
+            "UPDATE bills SET search = to_tsvector('simple', %s) WHERE id = %s",
+            (document, bill_id)
+        )
+    
+    def stream_cursor(self, conn):
+        # Named cursors stay on the server and are fetched page by page
+        return conn.cursor(name='bill_archive')
+    
+    def to_python(self, value):
+        if isinstance(value, Decimal):
+            return float(value)
+        if isinstance(value, datetime.datetime):
+            return value.strftime("%Y-%m-%d %H:%M:%S")
+        return value
+
+# Service worker for the billing page. The app shell and inventory are
+# served from cache straight away and refreshed in the background, so a
+# counter keeps working when the server or Wi-Fi is slow.
+SERVICE_WORKER_JS = '''
+const CACHE = 'rakshana-shell-v1';
+const SHELL = ['/', '/api/inventory'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(caches.open(CACHE).then(cache => cache.addAll(SHELL)));
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(caches.keys().then(keys => Promise.all(
+        keys.filter(key => key !== CACHE).map(key => caches.delete(key))
+    )));
+    self.clients.claim();
+});
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || !SHELL.includes(url.pathname)) {
+        return;
+    }
+    event.respondWith(caches.open(CACHE).then(async cache => {
+        const cached = await cache.match(event.request);
+        const network = fetch(event.request).then(response => {
+            if (response.ok) cache.put(event.request, response.clone());
+            return response;
+        });
+        if (cached) {
+            event.waitUntil(network.catch(() => {}));
+            return cached;
+        }
+        return network;
+    }));
+});
+'''
 
 class BillingDatabase:
     def __init__(self):
         self.db_url = os.environ.get('DATABASE_URL')
         self.use_postgres = bool(self.db_url)
+        self.dialect = PostgresDialect(self.db_url) if self.use_postgres else SQLiteDialect()
         
         print(f"Database URL present: {bool(self.db_url)}")
         if self.db_url:
             print(f"Database URL format: {self.db_url[:20]}...")
         
-        self.init_database()
+        # Connecting and migrating is deferred until the database is first
+        # used, so importing this module and binding the port stay fast.
+        self._ready = False
+        self._ready_lock = threading.Lock()
+        self.schema_version = 0
+        self.last_error = None
+        
+        # PostgreSQL connections are pooled so prepared statements survive
+        # between requests. Failed connects back off instead of falling back.
+        self.pool_size = int(os.environ.get('DB_POOL_SIZE', 4))
+        self._pool = queue.LifoQueue()
+        self._prepared = {}
+        self._failures = 0
+        self._retry_at = 0.0
+    
+    def _connect(self):
+        if not self.use_postgres:
+            return self.dialect.connect()
+        
+        if '://' not in self.db_url and '=' not in self.db_url:
+            raise DatabaseUnavailable(f"Invalid DATABASE_URL format: {self.db_url[:20]}...")
+        
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise DatabaseUnavailable(
+                f"PostgreSQL unavailable, retrying in {self._retry_at - now:.1f}s"
+            )
+        try:
+            print("Connecting to PostgreSQL...")
+            conn = self.dialect.connect()
+        except Exception as e:
+            self._failures += 1
+            delay = min(30.0, 0.5 * 2 ** (self._failures - 1))
+            self._retry_at = time.monotonic() + delay
+            print(f"PostgreSQL connection failed ({e}), next attempt in {delay:.1f}s")
+            raise DatabaseUnavailable(str(e)) from e
+        
+        self._failures = 0
+        self._retry_at = 0.0
+        self._prepared[id(conn)] = set()
+        return conn
     
-    def get_connection(self):
+    def _acquire(self):
         if self.use_postgres:
-            try:
-                import psycopg2
-                # Handle different URL formats
-                db_url = self.db_url
-                if db_url and not db_url.startswith('postgresql://'):
-                    # If it's just the host, construct proper URL
-                    if '=' not in db_url and 'postgresql://' not in db_url:
-                        print(f"Invalid DATABASE_URL format: {db_url}")
-                        print("Falling back to SQLite...")
-                        self.use_postgres = False
-                        return sqlite3.connect('billing_records.db')
-                
-                print("Connecting to PostgreSQL...")
-                return psycopg2.connect(db_url)
-            except (ImportError, Exception) as e:
-                print(f"PostgreSQL connection failed: {e}")
-                print("Falling back to SQLite...")
-                self.use_postgres = False
-                return sqlite3.connect('billing_records.db')
+            while True:
+                try:
+                    conn = self._pool.get_nowait()
+                except queue.Empty:
+                    break
+                if not conn.closed:
+                    return conn
+                self._prepared.pop(id(conn), None)
+        return self._connect()
+    
+    def _release(self, conn):
+        if not self.use_postgres:
+            conn.close()
+            return
+        if conn.closed:
+            self._prepared.pop(id(conn), None)
+            return
+        conn.rollback()
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(conn)
         else:
-            print("Using SQLite database...")
-            return sqlite3.connect('billing_records.db')
+            self._prepared.pop(id(conn), None)
+            conn.close()
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a ready connection; callers commit, it is rolled back and returned."""
+        if not self.ensure_ready():
+            raise DatabaseUnavailable(self.last_error or "Database not ready")
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+    
+    def execute_prepared(self, cursor, conn, name, query, params=()):
+        self.dialect.execute_prepared(
+            cursor, self._prepared.setdefault(id(conn), set()), name, query, params
+        )
+    
+    def rows(self, cursor):
+        to_python = self.dialect.to_python
+        return [[to_python(value) for value in row] for row in cursor.fetchall()]
+    
+    def ensure_ready(self, wait=True):
+        """Connect and apply pending migrations once. Returns True when usable.
+        
+        With wait=False, returns False at once if another thread is connecting.
+        """
+        if self._ready:
+            return True
+        if not self._ready_lock.acquire(blocking=wait):
+            return False
+        try:
+            if self._ready:
+                return True
+            try:
+                started = time.monotonic()
+                self.init_database()
+                print(f"Database ready at schema version {self.schema_version} "
+                      f"in {(time.monotonic() - started) * 1000:.0f}ms")
+                self.last_error = None
+                self._ready = True
+            except Exception as e:
+                print(f"Database initialization failed: {e}")
+                self.last_error = str(e)
+        finally:
+            self._ready_lock.release()
+        return self._ready
     
     def init_database(self):
-        conn = self.get_connection()
+        conn = self._acquire()
         cursor = conn.cursor()
+        sql = self.dialect.sql
         
-        if self.use_postgres:
-            # PostgreSQL schema
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS bills (
-                    id SERIAL PRIMARY KEY,
-                    bill_no VARCHAR(50) UNIQUE,
-                    date TIMESTAMP,
-                    customer_name VARCHAR(255),
-                    customer_phone VARCHAR(20),
-                    customer_address TEXT,
-                    subtotal DECIMAL(10,2),
-                    cgst DECIMAL(10,2),
-                    sgst DECIMAL(10,2),
-                    total_amount DECIMAL(10,2),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS bill_items (
-                    id SERIAL PRIMARY KEY,
-                    bill_no VARCHAR(50),
-                    product_name VARCHAR(255),
-                    quantity INTEGER,
-                    unit_price DECIMAL(10,2),
-                    total_price DECIMAL(10,2),
-                    FOREIGN KEY (bill_no) REFERENCES bills (bill_no)
-                )
-            ''')
-        else:
-            # SQLite schema (existing)
+        try:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS bills (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    bill_no TEXT UNIQUE,
-                    date TEXT,
-                    customer_name TEXT,
-                    customer_phone TEXT,
-                    customer_address TEXT,
-                    subtotal REAL,
-                    cgst REAL,
-                    sgst REAL,
-                    total_amount REAL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS bill_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    bill_no TEXT,
-                    product_name TEXT,
-                    quantity INTEGER,
-                    unit_price REAL,
-                    total_price REAL,
-                    FOREIGN KEY (bill_no) REFERENCES bills (bill_no)
+            cursor.execute('SELECT MAX(version) FROM schema_version')
+            current = cursor.fetchone()[0] or 0
+            conn.commit()
+            
+            for version, description, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"Applying migration {version}: {description}")
+                # The statements and the version row commit together, so a crash
+                # part way through leaves the migration to be rerun in full
+                self.dialect.begin(conn)
+                for statement in statements[self.dialect.name]:
+                    cursor.execute(statement)
+                cursor.execute(
+                    sql('INSERT INTO schema_version (version, description) VALUES (?, ?)'),
+                    (version, description)
                 )
-            ''')
-        
-        conn.commit()
-        conn.close()
+                conn.commit()
+                current = version
+            
+            self.schema_version = current
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
     
     def save_bill(self, bill_data, items):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         try:
-            # Insert bill
-            cursor.execute('''
-                INSERT INTO bills (bill_no, date, customer_name, customer_phone, 
-                                 customer_address, subtotal, cgst, sgst, total_amount)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                bill_data['bill_no'], bill_data['date'], bill_data['customer_name'],
-                bill_data['customer_phone'], bill_data['customer_address'],
-                bill_data['subtotal'], bill_data['cgst'], bill_data['sgst'],
-                bill_data['total_amount']
-            ))
-            
-            # Insert bill items
-            for item in items:
-                cursor.execute('''
-                    INSERT INTO bill_items (bill_no, product_name, quantity, unit_price, total_price)
-                    VALUES (?, ?, ?, ?, ?)
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Insert bill
+                bill_id = self.dialect.insert_returning(cursor, '''
+                    INSERT INTO bills (bill_no, date, customer_name, customer_phone, 
+                                     customer_address, subtotal, cgst, sgst, total_amount)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
-                    bill_data['bill_no'], item['product'], item['qty'],
-                    item['price'], item['price'] * item['qty']
+                    bill_data['bill_no'], bill_data['date'], bill_data['customer_name'],
+                    bill_data['customer_phone'], bill_data['customer_address'],
+                    bill_data['subtotal'], bill_data['cgst'], bill_data['sgst'],
+                    bill_data['total_amount']
                 ))
-            
-            conn.commit()
-            return True
+                
+                # Insert bill items in one batch
+                self.dialect.insert_many(
+                    cursor, 'bill_items',
+                    ('bill_no', 'product_name', 'quantity', 'unit_price', 'total_price'),
+                    [(bill_data['bill_no'], item['product'], item['qty'],
+                      item['price'], item['price'] * item['qty']) for item in items]
+                )
+                
+                # Keep the search index in the same transaction
+                self.dialect.index_bill(cursor, bill_id, bill_data, items)
+                
+                conn.commit()
+                bill_data['id'] = bill_id
+                return True
         except Exception as e:
             print(f"Database error: {e}")
             return False
-        finally:
-            conn.close()
     
-    def get_bills(self, limit=50):
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def save_bills(self, bills):
+        """Save a batch of (bill_data, items) from offline clients in one transaction.
         
-        cursor.execute('''
-            SELECT bill_no, date, customer_name, customer_phone, total_amount
-            FROM bills ORDER BY created_at DESC LIMIT ?
-        ''', (limit,))
+        Bills whose client_id is already stored are skipped. Each bill is
+        inserted under a savepoint, so one that violates a constraint (e.g. a
+        bill_no taken by another till) is rolled back alone. Returns the
+        client_ids saved, the ones that were duplicates and the ones that failed.
+        Any other database error fails the whole batch so the client retries.
+        """
+        sql = self.dialect.sql
+        client_ids = [bill_data['client_id'] for bill_data, _ in bills]
+        saved, duplicates, failed = [], [], []
+        if not bills:
+            return saved, duplicates, failed
         
-        bills = cursor.fetchall()
-        conn.close()
-        return bills
+        with self.connection() as conn:
+            self.dialect.begin(conn)
+            cursor = conn.cursor()
+            placeholders = ', '.join('?' for _ in client_ids)
+            cursor.execute(sql(f'SELECT client_id FROM bills WHERE client_id IN ({placeholders})'),
+                           client_ids)
+            existing = {row[0] for row in cursor.fetchall()}
+            
+            line_rows = []
+            for bill_data, items in bills:
+                if bill_data['client_id'] in existing:
+                    duplicates.append(bill_data['client_id'])
+                    continue
+                existing.add(bill_data['client_id'])
+                
+                cursor.execute('SAVEPOINT sync_bill')
+                try:
+                    bill_id = self.dialect.insert_returning(cursor, '''
+                        INSERT INTO bills (bill_no, date, customer_name, customer_phone,
+                                         customer_address, subtotal, cgst, sgst, total_amount,
+                                         client_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (
+                        bill_data['bill_no'], bill_data['date'], bill_data['customer_name'],
+                        bill_data['customer_phone'], bill_data['customer_address'],
+                        bill_data['subtotal'], bill_data['cgst'], bill_data['sgst'],
+                        bill_data['total_amount'], bill_data['client_id']
+                    ))
+                    self.dialect.index_bill(cursor, bill_id, bill_data, items)
+                except self.dialect.integrity_error as e:
+                    cursor.execute('ROLLBACK TO SAVEPOINT sync_bill')
+                    # Another tab or request may have saved the same bill since the check above
+                    cursor.execute(sql('SELECT 1 FROM bills WHERE client_id = ?'),
+                                   (bill_data['client_id'],))
+                    if cursor.fetchone():
+                        duplicates.append(bill_data['client_id'])
+                    else:
+                        print(f"Error saving synced bill {bill_data['bill_no']}: {e}")
+                        failed.append(bill_data['client_id'])
+                    continue
+                cursor.execute('RELEASE SAVEPOINT sync_bill')
+                bill_data['id'] = bill_id
+                line_rows.extend(
+                    (bill_data['bill_no'], item['product'], item['qty'],
+                     item['price'], item['price'] * item['qty']) for item in items
+                )
+                saved.append(bill_data['client_id'])
+            
+            # All line items for the batch go in one insert
+            if line_rows:
+                self.dialect.insert_many(
+                    cursor, 'bill_items',
+                    ('bill_no', 'product_name', 'quantity', 'unit_price', 'total_price'),
+                    line_rows
+                )
+            conn.commit()
+        return saved, duplicates, failed
+    
+    def get_bills(self, limit=50):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self.execute_prepared(cursor, conn, 'recent_bills', '''
+                SELECT bill_no, date, customer_name, customer_phone, total_amount
+                FROM bills ORDER BY created_at DESC LIMIT ?
+            ''', (limit,))
+            return self.rows(cursor)
+    
+    def search_bills(self, text, page=1, per_page=20):
+        """Ranked bills matching text. Returns (rows, has_more)."""
+        terms = self.dialect.search_terms(text)
+        if not terms:
+            return [], False
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self.execute_prepared(cursor, conn, 'search_bills', self.dialect.search_query,
+                                  (terms, per_page + 1, (page - 1) * per_page))
+            rows = self.rows(cursor)
+        return rows[:per_page], len(rows) > per_page
+    
+    def iter_bill_pages(self, date_from, date_to, page_size=200):
+        """Yield pages of (bill_data, items) for bills dated date_from <= date < date_to.
+        
+        Only one page is held in memory at a time.
+        """
+        sql = self.dialect.sql
+        to_python = self.dialect.to_python
+        columns = ('bill_no', 'date', 'customer_name', 'customer_phone', 'customer_address',
+                   'subtotal', 'cgst', 'sgst', 'total_amount')
+        with self.connection() as conn:
+            bills_cursor = self.dialect.stream_cursor(conn)
+            bills_cursor.execute(sql(f'''
+                SELECT {', '.join(columns)} FROM bills
+                WHERE date >= ? AND date < ? ORDER BY date, id
+            '''), (date_from, date_to))
+            items_cursor = conn.cursor()
+            
+            while True:
+                rows = bills_cursor.fetchmany(page_size)
+                if not rows:
+                    break
+                bills = [dict(zip(columns, map(to_python, row))) for row in rows]
+                
+                placeholders = ', '.join('?' for _ in bills)
+                items_cursor.execute(sql(f'''
+                    SELECT bill_no, product_name, quantity, unit_price FROM bill_items
+                    WHERE bill_no IN ({placeholders}) ORDER BY id
+                '''), [bill['bill_no'] for bill in bills])
+                items = {}
+                for bill_no, product, qty, price in items_cursor.fetchall():
+                    price = to_python(price)
+                    if isinstance(price, float) and price.is_integer():
+                        price = int(price)
+                    items.setdefault(bill_no, []).append({"product": product, "qty": qty, "price": price})
+                
+                yield [(bill, items.get(bill['bill_no'], [])) for bill in bills]
+    
+    def get_summary(self, limit=10):
+        """Bill count and most recent bills for the database viewer."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM bills')
+            bill_count = cursor.fetchone()[0]
+            self.execute_prepared(cursor, conn, 'recent_bill_summary', '''
+                SELECT bill_no, date, customer_name, total_amount
+                FROM bills ORDER BY created_at DESC LIMIT ?
+            ''', (limit,))
+            return bill_count, self.rows(cursor)
+
+class AdmissionController:
+    """Per-route concurrency limits with a bounded, priority-ordered wait queue.
+
+    Requests are grouped into classes. Lower priority numbers are admitted
+    first when a slot frees up, so checkout is never stuck behind history
+    browsing. When the queue is full or a request waits too long it is shed
+    and the caller answers with a fast 503.
+    """
+
+    # class name -> (priority, default concurrency limit)
+    CLASSES = {
+        'checkout': (0, 8),
+        'counter': (1, 8),
+        'history': (2, 2),
+    }
+
+    ROUTES = {
+        '/api/generate-bill': 'checkout',
+        '/api/bills/sync': 'checkout',
+        '/api/bills/archive': 'history',
+        '/api/bills': 'history',
+        '/api/bills/search': 'history',
+        '/admin/database': 'history',
+    }
+
+    def __init__(self):
+        self.limits = {name: limit for name, (_, limit) in self.CLASSES.items()}
+        for entry in os.environ.get('ADMISSION_LIMITS', '').split(','):
+            if '=' in entry:
+                name, value = entry.split('=', 1)
+                if name.strip() in self.limits:
+                    self.limits[name.strip()] = int(value)
+        self.max_active = int(os.environ.get('ADMISSION_MAX_ACTIVE', 16))
+        self.queue_size = int(os.environ.get('ADMISSION_QUEUE_SIZE', 32))
+        self.queue_timeout = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2.0))
+        self.retry_after = int(os.environ.get('ADMISSION_RETRY_AFTER', 2))
+
+        self.cond = threading.Condition()
+        self.active = {name: 0 for name in self.CLASSES}
+        self.waiting = {name: 0 for name in self.CLASSES}
+        self.stats = {name: {'admitted': 0, 'shed': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+                      for name in self.CLASSES}
+
+    def classify(self, path):
+        path = path.split('?', 1)[0]
+        if path.startswith('/download/'):
+            return 'history'
+        return self.ROUTES.get(path, 'counter')
+
+    def _queue_limit(self, name):
+        # Lower priority classes may only use a shrinking share of the queue,
+        # so history requests are shed first when the counter gets busy.
+        priority = self.CLASSES[name][0]
+        return max(1, self.queue_size >> priority)
+
+    def _can_run(self, name):
+        if self.active[name] >= self.limits[name]:
+            return False
+        if sum(self.active.values()) >= self.max_active:
+            return False
+        priority = self.CLASSES[name][0]
+        for other, (other_priority, _) in self.CLASSES.items():
+            if other_priority < priority and self.waiting[other] and self._slot_free(other):
+                return False
+        return True
+
+    def _slot_free(self, name):
+        return self.active[name] < self.limits[name]
+
+    def acquire(self, name):
+        """Wait for a slot. Returns the queue wait in seconds, or None if shed."""
+        start = time.monotonic()
+        with self.cond:
+            if not self._can_run(name):
+                if sum(self.waiting.values()) >= self._queue_limit(name):
+                    self.stats[name]['shed'] += 1
+                    return None
+                self.waiting[name] += 1
+                deadline = start + self.queue_timeout
+                try:
+                    while not self._can_run(name):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.stats[name]['shed'] += 1
+                            return None
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting[name] -= 1
+            self.active[name] += 1
+            waited = time.monotonic() - start
+            stats = self.stats[name]
+            stats['admitted'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+            return waited
+
+    def release(self, name):
+        with self.cond:
+            self.active[name] -= 1
+            self.cond.notify_all()
+
+    def snapshot(self):
+        with self.cond:
+            report = {}
+            for name, stats in self.stats.items():
+                admitted = stats['admitted']
+                report[name] = {
+                    'limit': self.limits[name],
+                    'active': self.active[name],
+                    'waiting': self.waiting[name],
+                    'admitted': admitted,
+                    'shed': stats['shed'],
+                    'avg_wait_ms': round(stats['wait_total'] / admitted * 1000, 2) if admitted else 0.0,
+                    'max_wait_ms': round(stats['wait_max'] * 1000, 2),
+                }
+            return {
+                'max_active': self.max_active,
+                'queue_size': self.queue_size,
+                'queue_timeout': self.queue_timeout,
+                'classes': report,
+            }
+
+class RequestProfiler:
+    """Sampled cProfile of request handlers, aggregated per route.
+
+    Disabled by default. Enable with PROFILE_SAMPLE_RATE, by POSTing
+    {"sample_rate": 0.1} to /admin/profile, or per request with an
+    X-Profile: 1 header. When off, a request costs one comparison.
+    """
+
+    def __init__(self):
+        self.sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+        self.allow_header = os.environ.get('PROFILE_HEADER', '1') == '1'
+        self.lock = threading.Lock()
+        # Only one cProfile can be active at a time; other requests run unprofiled
+        self.active = threading.Lock()
+        self.routes = {}
+        self.counts = {}
+
+    def should_profile(self, headers):
+        if self.sample_rate <= 0 and not self.allow_header:
+            return False
+        if self.allow_header and headers.get('X-Profile') == '1':
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def run(self, route, handler):
+        if not self.active.acquire(blocking=False):
+            return handler()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                return handler()
+            finally:
+                profile.disable()
+        finally:
+            self.active.release()
+            self.record(route, profile)
+
+    def record(self, route, profile):
+        with self.lock:
+            if route in self.routes:
+                self.routes[route].add(profile)
+            else:
+                self.routes[route] = pstats.Stats(profile)
+            self.counts[route] = self.counts.get(route, 0) + 1
+
+    def top(self, route=None, limit=20):
+        with self.lock:
+            report = {}
+            for name, stats in self.routes.items():
+                if route and name != route:
+                    continue
+                rows = sorted(stats.stats.items(), key=lambda entry: entry[1][3], reverse=True)
+                report[name] = {
+                    'requests': self.counts[name],
+                    'total_time': round(stats.total_tt, 4),
+                    'functions': [
+                        {
+                            'function': f"{os.path.basename(filename)}:{line}({func})",
+                            'calls': ncalls,
+                            'tottime': round(tottime, 4),
+                            'cumtime': round(cumtime, 4),
+                        }
+                        for (filename, line, func), (_, ncalls, tottime, cumtime, _) in rows[:limit]
+                    ],
+                }
+            return {'sample_rate': self.sample_rate, 'routes': report}
+
+    def dump(self):
+        # Write one .prof file per route for offline analysis with pstats/snakeviz
+        files = []
+        with self.lock:
+            for name, stats in self.routes.items():
+                filename = 'profile_' + (name.strip('/').replace('/', '_') or 'root') + '.prof'
+                stats.dump_stats(filename)
+                files.append(filename)
+        return files
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+            self.counts = {}
+
+class EventHub:
+    """Fan-out of server-sent events to connected counters.
+
+    Each subscriber gets a bounded queue. Publishing never blocks: a client
+    that falls too far behind is disconnected and resynchronises with a
+    fresh snapshot when its EventSource reconnects.
+    """
+
+    def __init__(self):
+        self.max_clients = int(os.environ.get('SSE_MAX_CLIENTS', 50))
+        self.queue_size = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.dropped = 0
+
+    def subscribe(self):
+        with self.lock:
+            if len(self.subscribers) >= self.max_clients:
+                return None
+            subscriber = queue.Queue(maxsize=self.queue_size)
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        self.unsubscribe(subscriber)
+        self.dropped += 1
+        # Discard the backlog and wake the stream so it closes promptly
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            subscriber.put_nowait(None)
+        except queue.Full:
+            pass
+
+class ChunkedWriter:
+    """Write-only file object that sends HTTP/1.1 chunks of about chunk_size bytes."""
+
+    def __init__(self, wfile, chunk_size=64 * 1024):
+        self.wfile = wfile
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self._send()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _send(self):
+        if self.buffer:
+            self.wfile.write(b'%x\r\n' % len(self.buffer))
+            self.wfile.write(self.buffer)
+            self.wfile.write(b'\r\n')
+            self.buffer.clear()
+
+    def close(self):
+        self._send()
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+class CartLine:
+    """A cart row: catalog product ID and quantity.
+
+    Name, price and GST are looked up from the catalog when the cart is
+    shown or billed, so client-supplied prices are never trusted.
+    """
+    __slots__ = ('product_id', 'qty')
+
+    def __init__(self, product_id, qty):
+        self.product_id = product_id
+        self.qty = qty
 
 class CrackerBillingHandler(BaseHTTPRequestHandler):
+    # Product IDs are permanent: carts, cached pages and queued offline bills
+    # refer to products by id. Never renumber or reuse one; give a new
+    # product the next unused id.
     inventory = {
-        "Kuruvi Crackers (2-3/4\")" : {"price": 5, "gst": 18},
-        "Electric Sparklers (10cm)": {"price": 25, "gst": 18},
-        "Electric Sparklers (15cm)": {"price": 40, "gst": 18},
-        "Electric Sparklers (30cm)": {"price": 80, "gst": 18},
-        "Color Sparklers": {"price": 60, "gst": 18},
-        "Ground Chakkar Small": {"price": 15, "gst": 18},
-        "Ground Chakkar Big": {"price": 35, "gst": 18},
-        "Flower Pot Small": {"price": 20, "gst": 18},
-        "Flower Pot Big": {"price": 45, "gst": 18},
-        "Color Flower Pot": {"price": 65, "gst": 18},
-        "Fountain Small": {"price": 80, "gst": 18},
-        "Fountain Big": {"price": 150, "gst": 18},
-        "Baby Rocket": {"price": 8, "gst": 18},
-        "Rocket Small": {"price": 15, "gst": 18},
-        "Rocket Big": {"price": 25, "gst": 18},
-        "Whistling Rocket": {"price": 35, "gst": 18},
-        "Lakshmi Bomb": {"price": 5, "gst": 18},
-        "Atom Bomb": {"price": 12, "gst": 18},
-        "Hydrogen Bomb": {"price": 25, "gst": 18},
-        "Garland 100": {"price": 80, "gst": 18},
-        "Garland 1000": {"price": 600, "gst": 18},
-        "Family Pack": {"price": 500, "gst": 18},
-        "Deluxe Gift Box": {"price": 800, "gst": 18},
-        "Safety Matches": {"price": 5, "gst": 5}
+        "Kuruvi Crackers (2-3/4\")" : {"id": 0, "price": 5, "gst": 18},
+        "Electric Sparklers (10cm)": {"id": 1, "price": 25, "gst": 18},
+        "Electric Sparklers (15cm)": {"id": 2, "price": 40, "gst": 18},
+        "Electric Sparklers (30cm)": {"id": 3, "price": 80, "gst": 18},
+        "Color Sparklers": {"id": 4, "price": 60, "gst": 18},
+        "Ground Chakkar Small": {"id": 5, "price": 15, "gst": 18},
+        "Ground Chakkar Big": {"id": 6, "price": 35, "gst": 18},
+        "Flower Pot Small": {"id": 7, "price": 20, "gst": 18},
+        "Flower Pot Big": {"id": 8, "price": 45, "gst": 18},
+        "Color Flower Pot": {"id": 9, "price": 65, "gst": 18},
+        "Fountain Small": {"id": 10, "price": 80, "gst": 18},
+        "Fountain Big": {"id": 11, "price": 150, "gst": 18},
+        "Baby Rocket": {"id": 12, "price": 8, "gst": 18},
+        "Rocket Small": {"id": 13, "price": 15, "gst": 18},
+        "Rocket Big": {"id": 14, "price": 25, "gst": 18},
+        "Whistling Rocket": {"id": 15, "price": 35, "gst": 18},
+        "Lakshmi Bomb": {"id": 16, "price": 5, "gst": 18},
+        "Atom Bomb": {"id": 17, "price": 12, "gst": 18},
+        "Hydrogen Bomb": {"id": 18, "price": 25, "gst": 18},
+        "Garland 100": {"id": 19, "price": 80, "gst": 18},
+        "Garland 1000": {"id": 20, "price": 600, "gst": 18},
+        "Family Pack": {"id": 21, "price": 500, "gst": 18},
+        "Deluxe Gift Box": {"id": 22, "price": 800, "gst": 18},
+        "Safety Matches": {"id": 23, "price": 5, "gst": 5}
     }
     
-    # Shared cart across all requests
+    # Catalog lookups by integer product ID
+    product_names = {details["id"]: name for name, details in inventory.items()}
+    product_ids = {name: details["id"] for name, details in inventory.items()}
+    product_prices = {details["id"]: details["price"] for details in inventory.values()}
+    product_gst = {details["id"]: details["gst"] for details in inventory.values()}
+    
+    # Shared cart of CartLine across all requests
     cart = []
+    cart_lock = threading.Lock()
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
     
     db = BillingDatabase()
+    admission = AdmissionController()
+    profiler = RequestProfiler()
+    events = EventHub()
+    profile_routes = frozenset([
+        '/', '/sw.js', '/download/', '/api/inventory', '/api/cart', '/api/bills',
+        '/api/bills/search', '/api/bills/archive', '/api/bills/sync', '/api/add-item',
+        '/api/generate-bill', '/api/clear-cart', '/api/remove-item', '/admin/database',
+        '/admin/profile',
+    ])
+    # Renders bills for ZIP export while the request thread compresses
+    render_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('ARCHIVE_WORKERS', 4)),
+                                     thread_name_prefix='bill-render')
     
     def do_GET(self):
+        self.admit(self.handle_get)
+    
+    def do_POST(self):
+        self.admit(self.handle_post)
+    
+    def admit(self, handler):
+        if self.path == '/admin/admission':
+            # Always answer the stats endpoint so capacity can be inspected under load
+            self.send_json(self.admission.snapshot())
+            return
+        if self.path == '/healthz':
+            self.send_health()
+            return
+        if self.path == '/api/events':
+            # Long-lived streams are capped by the event hub, not the admission queue
+            self.stream_events()
+            return
+        
+        route_class = self.admission.classify(self.path)
+        waited = self.admission.acquire(route_class)
+        if waited is None:
+            self.send_busy()
+            return
+        
+        try:
+            if waited > 0.5:
+                print(f"Queued {waited * 1000:.0f}ms before {self.command} {self.path}")
+            if self.profiler.should_profile(self.headers):
+                self.profiler.run(self.profile_route(), handler)
+            else:
+                handler()
+        finally:
+            self.admission.release(route_class)
+    
+    def stream_events(self):
+        with self.cart_lock:
+            subscriber = self.events.subscribe()
+            snapshot = self.resolve_cart()
+        if subscriber is None:
+            self.send_busy()
+            return
+        
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.end_headers()
+            self.wfile.write(f"retry: 3000\nevent: cart\ndata: {json.dumps(snapshot)}\n\n".encode())
+            self.wfile.flush()
+            
+            while True:
+                try:
+                    message = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # Keep proxies from closing an idle stream
+                    message = b": keepalive\n\n"
+                if message is None:
+                    break
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.events.unsubscribe(subscriber)
+    
+    def client_id(self):
+        # Lets a page ignore pushed events for changes it already applied locally
+        return self.headers.get('X-Client-Id')
+    
+    def route_name(self):
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/download/'):
+            return '/download/'
+        return path
+    
+    def profile_route(self):
+        # Unknown paths share one bucket so profiled stats stay bounded
+        route = self.route_name()
+        return route if route in self.profile_routes else 'other'
+    
+    def send_busy(self):
+        body = json.dumps({"error": "Server busy, please retry shortly"}).encode()
+        self.send_response(503)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Retry-After', str(self.admission.retry_after))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_health(self):
+        # Probes must answer promptly, so never wait behind a connection attempt
+        ready = self.db.ensure_ready(wait=False)
+        body = json.dumps({
+            "status": "ok" if ready else "unavailable",
+            "database": self.db.dialect.label,
+            "schema_version": self.db.schema_version,
+            "startup_ms": self.server.startup_ms,
+            "error": self.db.last_error,
+        }).encode()
+        self.send_response(200 if ready else 503)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def handle_get(self):
         if self.path == '/':
             self.send_response(200)
             self.send_header('Content-type', 'text/html')
             self.end_headers()
             self.wfile.write(self.get_html().encode())
+        elif self.path == '/sw.js':
+            self.send_response(200)
+            self.send_header('Content-type', 'application/javascript')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(SERVICE_WORKER_JS.encode())
         elif self.path == '/api/inventory':
             print(f"Inventory request - sending {len(self.inventory)} items")
             self.send_json(self.inventory)
         elif self.path == '/api/cart':
-            self.send_json(self.__class__.cart)
+            with self.cart_lock:
+                items = self.resolve_cart()
+            self.send_json(items)
+        elif self.route_name() == '/api/bills/search':
+            query = parse_qs(urlsplit(self.path).query)
+            text = query.get('q', [''])[0]
+            try:
+                # Bounded so OFFSET stays within a 64-bit integer
+                page = min(10000, max(1, int(query.get('page', [1])[0])))
+                per_page = min(100, max(1, int(query.get('per_page', [20])[0])))
+                results, has_more = self.db.search_bills(text, page, per_page)
+            except ValueError:
+                self.send_json({"error": "Invalid page"})
+                return
+            except DatabaseUnavailable as e:
+                self.send_json({"error": f"Database unavailable: {e}"})
+                return
+            self.send_json({
+                "query": text, "page": page, "per_page": per_page,
+                "results": results, "has_more": has_more
+            })
         elif self.path == '/api/bills':
-            bills = self.db.get_bills()
+            try:
+                bills = self.db.get_bills()
+            except DatabaseUnavailable as e:
+                self.send_json({"error": f"Database unavailable: {e}"})
+                return
             self.send_json(bills)
         elif self.path == '/admin/database':
             # Simple database viewer
@@ -214,23 +1202,14 @@ class CrackerBillingHandler(BaseHTTPRequestHandler):
             self.end_headers()
             
             try:
-                conn = self.db.get_connection()
-                cursor = conn.cursor()
-                
-                # Get bills count
-                cursor.execute('SELECT COUNT(*) FROM bills')
-                bill_count = cursor.fetchone()[0]
-                
-                # Get recent bills
-                cursor.execute('SELECT bill_no, date, customer_name, total_amount FROM bills ORDER BY created_at DESC LIMIT 10')
-                bills = cursor.fetchall()
+                bill_count, bills = self.db.get_summary()
                 
                 html = f'''
                 <html><head><title>Database Viewer</title></head>
                 <body style="font-family: Arial; padding: 20px;">
                 <h2>Rakshana Crackers - Database Status</h2>
                 <p><strong>Total Bills:</strong> {bill_count}</p>
-                <p><strong>Database Type:</strong> {"PostgreSQL" if self.db.use_postgres else "SQLite"}</p>
+                <p><strong>Database Type:</strong> {self.db.dialect.label}</p>
                 <h3>Recent Bills:</h3>
                 <table border="1" style="border-collapse: collapse; width: 100%;">
                 <tr><th>Bill No</th><th>Date</th><th>Customer</th><th>Amount</th></tr>
@@ -241,28 +1220,38 @@ class CrackerBillingHandler(BaseHTTPRequestHandler):
                 
                 html += '</table><br><a href="/">← Back to Billing</a></body></html>'
                 self.wfile.write(html.encode())
-                conn.close()
                 
             except Exception as e:
                 error_html = f'<html><body><h2>Database Error</h2><p>{str(e)}</p><a href="/">← Back</a></body></html>'
                 self.wfile.write(error_html.encode())
+        elif self.route_name() == '/admin/profile':
+            query = parse_qs(urlsplit(self.path).query)
+            route = query.get('route', [None])[0]
+            try:
+                limit = max(1, int(query.get('limit', [20])[0]))
+            except ValueError:
+                self.send_json({"error": "limit must be a whole number"})
+                return
+            self.send_json(self.profiler.top(route, limit))
+        elif self.route_name() == '/api/bills/archive':
+            self.send_archive()
         elif self.path.startswith('/download/'):
-            # Download bill file
+            # Download bill file, streamed rather than read into memory
             filename = self.path.split('/')[-1]
             try:
-                with open(filename, 'r') as f:
-                    content = f.read()
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
-                self.end_headers()
-                self.wfile.write(content.encode())
+                with open(filename, 'rb') as f:
+                    self.send_response(200)
+                    self.send_header('Content-type', 'text/plain')
+                    self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+                    self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+                    self.end_headers()
+                    shutil.copyfileobj(f, self.wfile)
             except FileNotFoundError:
                 self.send_response(404)
                 self.end_headers()
                 self.wfile.write(b'File not found')
     
-    def do_POST(self):
+    def handle_post(self):
         try:
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length == 0:
@@ -287,19 +1276,66 @@ class CrackerBillingHandler(BaseHTTPRequestHandler):
             return
         
         if self.path == '/api/add-item':
-            self.__class__.cart.append(data)
+            line = self.parse_cart_line(data)
+            if line is None:
+                self.send_json({"error": "Unknown product or invalid quantity"})
+                return
+            with self.cart_lock:
+                self.__class__.cart.append(line)
+                self.events.publish('cart-add', {**self.resolve_line(line), "origin": self.client_id()})
             self.send_json({"success": True})
         elif self.path == '/api/generate-bill':
-            bill_text, bill_data = self.generate_bill(data)
+            customer = self.clean_customer(data)
+            if customer is None:
+                self.send_json({"error": "Customer name, phone and address must be text"})
+                return
+            # Snapshot the cart under the lock; file and database writes happen
+            # outside it so cart edits and event subscribers are not held up
+            with self.cart_lock:
+                items = self.resolve_cart()
+            bill_text, bill_data = self.generate_bill(customer, items)
             filename = self.save_bill_file(bill_text)
-            success = self.db.save_bill(bill_data, self.__class__.cart)
+            success = self.db.save_bill(bill_data, items)
+            if success:
+                self.events.publish('bill', [
+                    bill_data['bill_no'], bill_data['date'], bill_data['customer_name'],
+                    bill_data['customer_phone'], bill_data['total_amount']
+                ])
             self.send_json({"bill": bill_text, "filename": filename, "saved": success})
+        elif self.path == '/api/bills/sync':
+            self.sync_bills(data)
         elif self.path == '/api/clear-cart':
-            self.__class__.cart = []
+            with self.cart_lock:
+                self.__class__.cart = []
+                self.events.publish('cart-clear', {"origin": self.client_id()})
             self.send_json({"success": True})
+        elif self.path == '/admin/profile':
+            if not isinstance(data, dict):
+                self.send_json({"error": "Expected a JSON object"})
+                return
+            if 'sample_rate' in data:
+                try:
+                    sample_rate = float(data['sample_rate'])
+                except (TypeError, ValueError):
+                    sample_rate = None
+                if sample_rate is None or math.isnan(sample_rate):
+                    self.send_json({"error": "sample_rate must be a number between 0 and 1"})
+                    return
+                self.profiler.sample_rate = min(1.0, max(0.0, sample_rate))
+            files = self.profiler.dump() if data.get('dump') else []
+            if data.get('reset'):
+                self.profiler.reset()
+            self.send_json({"success": True, "sample_rate": self.profiler.sample_rate, "files": files})
         elif self.path == '/api/remove-item':
-            if 0 <= data['index'] < len(self.__class__.cart):
-                self.__class__.cart.pop(data['index'])
+            try:
+                index = int(data.get('index'))
+            except (AttributeError, TypeError, ValueError):
+                self.send_json({"error": "Invalid item index"})
+                return
+            with self.cart_lock:
+                if 0 <= index < len(self.__class__.cart):
+                    self.__class__.cart.pop(index)
+                    self.events.publish('cart-remove', {"index": index, "origin": self.client_id()})
             self.send_json({"success": True})
     
     def send_json(self, data):
@@ -308,24 +1344,206 @@ class CrackerBillingHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(data).encode())
     
+    def send_archive(self):
+        """Stream a ZIP of every bill dated between ?from= and ?to= (inclusive)."""
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            date_from = datetime.date.fromisoformat(query['from'][0])
+            date_to = datetime.date.fromisoformat(query['to'][0])
+        except (KeyError, ValueError):
+            self.send_json({"error": "from and to must be dates like 2025-10-01"})
+            return
+        if date_to < date_from or (date_to - date_from).days > 366:
+            self.send_json({"error": "to must not be before from, and the range must be at most one year"})
+            return
+        
+        pages = self.db.iter_bill_pages(
+            date_from.isoformat(), (date_to + datetime.timedelta(days=1)).isoformat()
+        )
+        try:
+            # Fetch the first page before committing to a 200 response
+            page = next(pages, None)
+        except DatabaseUnavailable as e:
+            self.send_json({"error": f"Database unavailable: {e}"})
+            return
+        
+        # Chunked encoding needs HTTP/1.1; the connection is closed afterwards
+        self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-type', 'application/zip')
+        self.send_header('Content-Disposition',
+                         f'attachment; filename="bills_{date_from}_{date_to}.zip"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        
+        out = ChunkedWriter(self.wfile)
+        count = 0
+        try:
+            # Level 1 deflate: bill text still compresses well at a fraction of the CPU
+            with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+                while page is not None:
+                    for name, date_time, text in self.render_pool.map(self.render_archive_entry, page):
+                        archive.writestr(zipfile.ZipInfo(name, date_time), text,
+                                         compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+                        count += 1
+                    page = next(pages, None)
+            out.close()
+            print(f"Exported {count} bills for {date_from} to {date_to}")
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"Bill export aborted by client after {count} bills")
+        finally:
+            pages.close()
+    
+    def render_archive_entry(self, entry):
+        bill_data, items = entry
+        bill_no = bill_data['bill_no'].replace('/', '_').replace('\\', '_')
+        
+        # Bills synced from offline counters have a stored file named after
+        # the bill number; everything else is re-rendered from the database
+        stored = f"bill_{bill_no}.txt"
+        if os.path.exists(stored):
+            with open(stored, 'r') as f:
+                text = f.read()
+        else:
+            text = self.format_bill(bill_data, items)
+        
+        # Dates are stored as "YYYY-MM-DD HH:MM:SS"; slicing beats strptime per bill
+        date = str(bill_data['date'])
+        try:
+            date_time = (int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                         int(date[11:13]), int(date[14:16]), int(date[17:19]))
+        except ValueError:
+            date_time = (1980, 1, 1, 0, 0, 0)
+        return f"{bill_no}.txt", date_time, text
+    
+    def sync_bills(self, data):
+        """Accept bills generated offline and queued by the billing page."""
+        if not isinstance(data, dict):
+            self.send_json({"error": "Expected a JSON object"})
+            return
+        queued = data.get('bills')
+        if not isinstance(queued, list) or len(queued) > 100:
+            self.send_json({"error": "Expected a list of at most 100 bills"})
+            return
+        
+        batch, rejected, texts = [], [], {}
+        for entry in queued:
+            if not isinstance(entry, dict):
+                rejected.append({"bill_id": None, "error": "Invalid bill"})
+                continue
+            client_id = entry.get('bill_id')
+            if not isinstance(client_id, str):
+                client_id = ''
+            bill_no = str(entry.get('bill_no', ''))
+            timestamp = str(entry.get('date', ''))
+            items = entry.get('items')
+            lines = [self.parse_cart_line(item) if isinstance(item, dict) else None
+                     for item in (items if isinstance(items, list) else [])]
+            customer = self.clean_customer(entry.get('customer') or {})
+            if not (0 < len(client_id) <= 64 and BILL_NO_PATTERN.match(bill_no)
+                    and SYNC_DATE_PATTERN.match(timestamp)) or not lines or None in lines \
+                    or customer is None:
+                rejected.append({"bill_id": client_id or None, "error": "Invalid bill"})
+                continue
+            
+            # Totals are recomputed from the catalog, never taken from the client
+            items = [self.resolve_line(line) for line in lines]
+            bill_text, bill_data = self.generate_bill(customer, items, bill_no, timestamp)
+            bill_data['client_id'] = client_id
+            batch.append((bill_data, items))
+            texts[client_id] = bill_text
+        
+        try:
+            saved, duplicates, failed = self.db.save_bills(batch)
+        except Exception as e:
+            print(f"Bill sync failed: {e}")
+            self.send_json({"error": "Could not save bills, retry later"})
+            return
+        
+        saved_ids = set(saved)
+        for bill_data, _ in batch:
+            if bill_data['client_id'] in saved_ids:
+                self.save_bill_file(texts[bill_data['client_id']], f"bill_{bill_data['bill_no']}.txt")
+                self.events.publish('bill', [
+                    bill_data['bill_no'], bill_data['date'], bill_data['customer_name'],
+                    bill_data['customer_phone'], bill_data['total_amount']
+                ])
+        
+        # Failed bills will not succeed on a retry either; the page sets them aside
+        rejected.extend({"bill_id": client_id, "error": "Could not save bill"} for client_id in failed)
+        if saved:
+            print(f"Synced {len(saved)} offline bills ({len(duplicates)} already saved)")
+        self.send_json({"accepted": saved, "duplicates": duplicates, "rejected": rejected})
+    
+    def clean_customer(self, customer):
+        """Customer details as bounded strings, or None if they are not text."""
+        if not isinstance(customer, dict):
+            return None
+        cleaned = {}
+        for key, default, max_length in CUSTOMER_FIELDS:
+            value = customer.get(key)
+            if value is None:
+                value = default
+            elif isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                return None
+            cleaned[key] = str(value).strip()[:max_length]
+        return cleaned
+    
+    def parse_cart_line(self, data):
+        # Accept a product ID, or a product name from older clients
+        if not isinstance(data, dict):
+            return None
+        product_id = data.get('product_id')
+        if product_id is None:
+            product_id = self.product_ids.get(data.get('product'))
+        try:
+            product_id = int(product_id)
+            qty = int(data.get('qty', 0))
+        except (TypeError, ValueError):
+            return None
+        if product_id not in self.product_names or qty <= 0:
+            return None
+        return CartLine(product_id, qty)
+    
+    def resolve_cart(self):
+        """Cart lines with name, price and GST filled in from the catalog."""
+        return [self.resolve_line(line) for line in self.__class__.cart]
+    
+    def resolve_line(self, line):
+        return {
+            "product_id": line.product_id,
+            "product": self.product_names[line.product_id],
+            "price": self.product_prices[line.product_id],
+            "qty": line.qty,
+            "gst": self.product_gst[line.product_id],
+        }
+    
     def calculate_gst(self, amount, gst_rate):
-        gst_amount = (amount * gst_rate) / 100
-        return round(gst_amount, 2)
+        # Whole paise with halves rounded up, in integer maths so that
+        # calculateGst in the billing page gives the same result
+        paise = round(amount * 100)
+        basis_points = round(gst_rate * 100)
+        return (paise * basis_points + 5000) // 10000 / 100
     
-    def generate_bill(self, customer_data):
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        bill_no = f"RPP{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+    def generate_bill(self, customer_data, items=None, bill_no=None, timestamp=None):
+        if items is None:
+            items = self.resolve_cart()
+        if timestamp is None:
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if bill_no is None:
+            bill_no = f"RPP{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
         
         subtotal = 0
         total_cgst = 0
         total_sgst = 0
         
         # Calculate totals
-        for item in self.__class__.cart:
+        for item in items:
             item_total = item["price"] * item["qty"]
             subtotal += item_total
             
-            gst_rate = self.inventory[item["product"]]["gst"]
+            gst_rate = item["gst"]
             cgst = self.calculate_gst(item_total, gst_rate / 2)
             sgst = self.calculate_gst(item_total, gst_rate / 2)
             total_cgst += cgst
@@ -333,56 +1551,61 @@ class CrackerBillingHandler(BaseHTTPRequestHandler):
         
         total_amount = subtotal + total_cgst + total_sgst
         
+        bill_data = {
+            'bill_no': bill_no,
+            'date': timestamp,
+            'customer_name': customer_data.get('name', 'Walk-in Customer'),
+            'customer_phone': customer_data.get('phone', 'N/A'),
+            'customer_address': customer_data.get('address', 'N/A'),
+            'subtotal': subtotal,
+            'cgst': total_cgst,
+            'sgst': total_sgst,
+            'total_amount': total_amount
+        }
+        
+        return self.format_bill(bill_data, items), bill_data
+    
+    def format_bill(self, bill_data, items):
+        """Printable bill text; also used to re-render stored bills."""
         bill_text = f"""========================================
         RAKSHANA CRACKERS
      CRACKER SHOP BILLING SYSTEM
 ========================================
-Bill No: {bill_no}
-Date: {timestamp}
-Customer: {customer_data.get('name', 'Walk-in Customer')}
-Phone: {customer_data.get('phone', 'N/A')}
-Address: {customer_data.get('address', 'N/A')}
+Bill No: {bill_data['bill_no']}
+Date: {bill_data['date']}
+Customer: {bill_data['customer_name']}
+Phone: {bill_data['customer_phone']}
+Address: {bill_data['customer_address']}
 GSTIN: 29ABCDE1234F1Z5 (Sample)
 ----------------------------------------
 ITEM                QTY  RATE    AMOUNT
 ----------------------------------------
 """
         
-        for item in self.__class__.cart:
+        for item in items:
             item_total = item["price"] * item["qty"]
             bill_text += f"{item['product'][:15]:<15} {item['qty']:>3} {item['price']:>5} {item_total:>8.2f}\n"
         
         bill_text += f"""----------------------------------------
-Subtotal:                    Rs.{subtotal:>8.2f}
-CGST @ 9%:                   Rs.{total_cgst:>8.2f}
-SGST @ 9%:                   Rs.{total_sgst:>8.2f}
+Subtotal:                    Rs.{bill_data['subtotal']:>8.2f}
+CGST @ 9%:                   Rs.{bill_data['cgst']:>8.2f}
+SGST @ 9%:                   Rs.{bill_data['sgst']:>8.2f}
 ----------------------------------------
-TOTAL AMOUNT:                Rs.{total_amount:>8.2f}
+TOTAL AMOUNT:                Rs.{bill_data['total_amount']:>8.2f}
 ----------------------------------------
 Thank you for shopping with us!
 Visit: rakshanacrackers.com
 ========================================"""
         
-        bill_data = {
-            'bill_no': bill_no,
-            'date': timestamp,
-            'customer_name': customer_data.get('name', 'Walk-in Customer'),
-            'customer_phone': customer_data.get('phone', 'N/A'),
-            'customer_address': customer_data.get('address', 'N/A'),
-            'subtotal': subtotal,
-            'cgst': total_cgst,
-            'sgst': total_sgst,
-            'total_amount': total_amount
-        }
-        
-        return bill_text, bill_data
+        return bill_text
     
-    def save_bill_file(self, bill):
+    def save_bill_file(self, bill, filename=None):
         import platform
         import pathlib
         
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"bill_RPP_{timestamp}.txt"
+        if filename is None:
+            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"bill_RPP_{timestamp}.txt"
         
         # Save locally (for server)
         with open(filename, 'w') as f:
@@ -488,6 +1711,7 @@ Visit: rakshanacrackers.com
         <div class="header">
             <h1>RAKSHANA CRACKERS</h1>
             <p>GST Enabled Fireworks Billing System</p>
+            <p><small id="syncStatus"></small></p>
         </div>
         
         <div class="tabs">
@@ -514,9 +1738,9 @@ Visit: rakshanacrackers.com
                     
                     <div class="section">
                         <h3>Customer Details</h3>
-                        <input type="text" id="customerName" placeholder="Customer Name">
-                        <input type="text" id="customerPhone" placeholder="Phone Number">
-                        <input type="text" id="customerAddress" placeholder="Address">
+                        <input type="text" id="customerName" placeholder="Customer Name" maxlength="255">
+                        <input type="text" id="customerPhone" placeholder="Phone Number" maxlength="20">
+                        <input type="text" id="customerAddress" placeholder="Address" maxlength="500">
                     </div>
                 </div>
                 
@@ -540,8 +1764,16 @@ Visit: rakshanacrackers.com
         <div id="history" class="tab-content">
             <div class="section">
                 <h3>Recent Bills</h3>
+                <input type="text" id="billSearch" placeholder="Search by bill no, customer, phone, address or product"
+                       onkeydown="if (event.key === 'Enter') searchBills(1)">
+                <button onclick="searchBills(1)">Search</button>
                 <div id="billsHistory" class="bills-history"></div>
-                <button onclick="loadBillHistory()">Refresh</button>
+                <div id="searchPager"></div>
+                <h3 style="margin-top: 15px;">Export Bills</h3>
+                <input type="date" id="exportFrom">
+                <input type="date" id="exportTo">
+                <button onclick="exportBills()">Download ZIP</button>
+                <button onclick="searchBills(1)">Refresh</button>
             </div>
         </div>
     </div>
@@ -549,6 +1781,13 @@ Visit: rakshanacrackers.com
     <script>
         let inventory = {};
         let cart = [];
+        let bills = [];
+        let billsLoaded = false;
+        let searching = false;
+        let cartDirty = false;
+        let queueDb = null;
+        let syncing = false;
+        const clientId = newBillId();
         
         function showTab(tabName) {
             document.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
@@ -556,7 +1795,8 @@ Visit: rakshanacrackers.com
             event.target.classList.add('active');
             document.getElementById(tabName).classList.add('active');
             
-            if (tabName === 'history') {
+            // History is fetched once, then kept current by pushed 'bill' events
+            if (tabName === 'history' && !billsLoaded) {
                 loadBillHistory();
             }
         }
@@ -606,53 +1846,74 @@ Visit: rakshanacrackers.com
                 return;
             }
             
-            const item = {
-                product: product,
-                price: inventory[product].price,
-                qty: qty,
-                gst: inventory[product].gst
-            };
-            
-            await fetch('/api/add-item', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(item)
-            });
-            
-            loadCart();
+            // Update the local cart first; the server copy is only a mirror
+            // for other counters and may lag when the network is slow
+            const details = inventory[product];
+            cart.push({product_id: details.id, product: product, price: details.price, qty: qty, gst: details.gst});
+            renderCart();
             document.getElementById('quantity').value = 1;
+            
+            mirrorCart('/api/add-item', {product_id: details.id, qty: qty});
+        }
+        
+        async function mirrorCart(path, body) {
+            try {
+                const response = await fetch(path, {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json', 'X-Client-Id': clientId},
+                    body: JSON.stringify(body)
+                });
+                if (!response.ok) cartDirty = true;
+            } catch (error) {
+                cartDirty = true;
+            }
+        }
+        
+        async function pushLocalCart() {
+            // Replace the server mirror with this counter's cart after reconnecting
+            cartDirty = false;
+            await mirrorCart('/api/clear-cart', {});
+            for (const item of cart) {
+                await mirrorCart('/api/add-item', {product_id: item.product_id, qty: item.qty});
+            }
         }
         
         async function loadCart() {
             try {
                 const response = await fetch('/api/cart');
                 cart = await response.json();
-                
-                // Update cart counter
-                document.getElementById('cartCount').textContent = cart.length;
-                
-                const cartDiv = document.getElementById('cart');
-                const gstDiv = document.getElementById('gstSummary');
-                
-                if (cart.length === 0) {
-                    cartDiv.innerHTML = '<p style="color: #666; font-style: italic;">Cart is empty - Add items to get started!</p>';
-                    gstDiv.innerHTML = '';
-                    // Also clear any bill display
-                    document.getElementById('billSection').style.display = 'none';
-                    return;
-                }
-                
-                let subtotal = 0;
-                let totalCGST = 0;
-                let totalSGST = 0;
-                let html = '';
-                
-                cart.forEach((item, index) => {
+                renderCart();
+            } catch (error) {
+                console.error('Error loading cart:', error);
+            }
+        }
+        
+        function renderCart() {
+            // Update cart counter
+            document.getElementById('cartCount').textContent = cart.length;
+            
+            const cartDiv = document.getElementById('cart');
+            const gstDiv = document.getElementById('gstSummary');
+            
+            if (cart.length === 0) {
+                cartDiv.innerHTML = '<p style="color: #666; font-style: italic;">Cart is empty - Add items to get started!</p>';
+                gstDiv.innerHTML = '';
+                // Also clear any bill display
+                document.getElementById('billSection').style.display = 'none';
+                return;
+            }
+            
+            let subtotal = 0;
+            let totalCGST = 0;
+            let totalSGST = 0;
+            let html = '';
+            
+            cart.forEach((item, index) => {
                 const itemTotal = item.price * item.qty;
                 subtotal += itemTotal;
                 
-                const cgst = (itemTotal * item.gst / 2) / 100;
-                const sgst = (itemTotal * item.gst / 2) / 100;
+                const cgst = calculateGst(itemTotal, item.gst / 2);
+                const sgst = calculateGst(itemTotal, item.gst / 2);
                 totalCGST += cgst;
                 totalSGST += sgst;
                 
@@ -683,12 +1944,78 @@ Visit: rakshanacrackers.com
         }
         
         async function removeItem(index) {
-            await fetch('/api/remove-item', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({index: index})
+            cart.splice(index, 1);
+            renderCart();
+            mirrorCart('/api/remove-item', {index: index});
+        }
+        
+        function newBillId() {
+            if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+            return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 10);
+        }
+        
+        function formatTimestamp(date) {
+            const pad = n => String(n).padStart(2, '0');
+            return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())} ` +
+                   `${pad(date.getHours())}:${pad(date.getMinutes())}:${pad(date.getSeconds())}`;
+        }
+        
+        function calculateGst(amount, rate) {
+            // Same rule as calculate_gst on the server: whole paise, halves up
+            const paise = Math.round(amount * 100);
+            const basisPoints = Math.round(rate * 100);
+            return Math.floor((paise * basisPoints + 5000) / 10000) / 100;
+        }
+        
+        function formatBill(billNo, timestamp, customer, items) {
+            // Same layout and GST rounding as generate_bill on the server
+            let subtotal = 0;
+            let totalCGST = 0;
+            let totalSGST = 0;
+            items.forEach(item => {
+                const itemTotal = item.price * item.qty;
+                subtotal += itemTotal;
+                totalCGST += calculateGst(itemTotal, item.gst / 2);
+                totalSGST += calculateGst(itemTotal, item.gst / 2);
             });
-            loadCart();
+            const totalAmount = subtotal + totalCGST + totalSGST;
+            const rule = '========================================';
+            const dash = '----------------------------------------';
+            const money = value => 'Rs.' + value.toFixed(2).padStart(8);
+            
+            const lines = [
+                rule,
+                '        RAKSHANA CRACKERS',
+                '     CRACKER SHOP BILLING SYSTEM',
+                rule,
+                `Bill No: ${billNo}`,
+                `Date: ${timestamp}`,
+                `Customer: ${customer.name}`,
+                `Phone: ${customer.phone}`,
+                `Address: ${customer.address}`,
+                'GSTIN: 29ABCDE1234F1Z5 (Sample)',
+                dash,
+                'ITEM                QTY  RATE    AMOUNT',
+                dash
+            ];
+            items.forEach(item => {
+                const itemTotal = item.price * item.qty;
+                lines.push(`${item.product.slice(0, 15).padEnd(15)} ${String(item.qty).padStart(3)} ` +
+                           `${String(item.price).padStart(5)} ${itemTotal.toFixed(2).padStart(8)}`);
+            });
+            lines.push(
+                dash,
+                `Subtotal:                    ${money(subtotal)}`,
+                `CGST @ 9%:                   ${money(totalCGST)}`,
+                `SGST @ 9%:                   ${money(totalSGST)}`,
+                dash,
+                `TOTAL AMOUNT:                ${money(totalAmount)}`,
+                dash,
+                'Thank you for shopping with us!',
+                'Visit: rakshanacrackers.com',
+                rule
+            );
+            return lines.join('\\n');
         }
         
         async function generateBill() {
@@ -698,19 +2025,27 @@ Visit: rakshanacrackers.com
             }
             
             const customerData = {
-                name: document.getElementById('customerName').value,
-                phone: document.getElementById('customerPhone').value,
-                address: document.getElementById('customerAddress').value
+                name: document.getElementById('customerName').value.trim(),
+                phone: document.getElementById('customerPhone').value.trim(),
+                address: document.getElementById('customerAddress').value.trim()
             };
             
-            const response = await fetch('/api/generate-bill', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(customerData)
+            // The bill is built and queued locally, then synced in the background
+            const billId = newBillId();
+            const now = new Date();
+            const timestamp = formatTimestamp(now);
+            const billNo = 'RPP' + timestamp.replace(/[^0-9]/g, '') + '-' + billId.replace(/-/g, '').slice(-6);
+            const billText = formatBill(billNo, timestamp, customerData, cart);
+            
+            await queueBill({
+                bill_id: billId,
+                bill_no: billNo,
+                date: timestamp,
+                customer: customerData,
+                items: cart.map(item => ({product_id: item.product_id, qty: item.qty}))
             });
             
-            const result = await response.json();
-            document.getElementById('bill').textContent = result.bill;
+            document.getElementById('bill').textContent = billText;
             document.getElementById('billSection').style.display = 'block';
             
             // Add download button
@@ -718,7 +2053,11 @@ Visit: rakshanacrackers.com
             downloadBtn.textContent = 'Download Bill';
             downloadBtn.style.marginTop = '10px';
             downloadBtn.onclick = () => {
-                window.open(`/download/${result.filename}`, '_blank');
+                const link = document.createElement('a');
+                link.href = URL.createObjectURL(new Blob([billText], {type: 'text/plain'}));
+                link.download = `bill_${billNo}.txt`;
+                link.click();
+                URL.revokeObjectURL(link.href);
             };
             
             const billSection = document.getElementById('billSection');
@@ -726,41 +2065,168 @@ Visit: rakshanacrackers.com
             if (existingBtn) existingBtn.remove();
             billSection.appendChild(downloadBtn);
             
-            if (result.saved) {
-                alert(`GST Bill generated and saved as ${result.filename}\\nBill saved to desktop/rakshana folder\\nBill record saved to database`);
-            } else {
-                alert(`Bill generated as ${result.filename}\\nBill saved to desktop/rakshana folder\\nWarning: Could not save to database`);
-            }
-            
-            clearCart();
+            cart = [];
+            renderCart();
+            document.getElementById('billSection').style.display = 'block';
+            mirrorCart('/api/clear-cart', {});
             document.getElementById('customerName').value = '';
             document.getElementById('customerPhone').value = '';
             document.getElementById('customerAddress').value = '';
+            
+            syncBills();
         }
         
         async function clearCart() {
-            // Only clear the visual display, not the actual cart data
-            const cartDiv = document.getElementById('cart');
-            const gstDiv = document.getElementById('gstSummary');
-            
-            cartDiv.innerHTML = '<p style="color: #666; font-style: italic;">Cart display cleared - Add items to refresh</p>';
-            gstDiv.innerHTML = '';
-            document.getElementById('cartCount').textContent = '0';
-            document.getElementById('billSection').style.display = 'none';
+            cart = [];
+            renderCart();
+            mirrorCart('/api/clear-cart', {});
+        }
+        
+        function openQueue() {
+            if (!queueDb) {
+                queueDb = new Promise((resolve, reject) => {
+                    const request = indexedDB.open('rakshana-billing', 2);
+                    request.onupgradeneeded = () => {
+                        // Version 2 adds failedBills for bills the server rejected
+                        const db = request.result;
+                        ['pendingBills', 'failedBills'].forEach(name => {
+                            if (!db.objectStoreNames.contains(name)) {
+                                db.createObjectStore(name, {keyPath: 'bill_id'});
+                            }
+                        });
+                    };
+                    request.onsuccess = () => resolve(request.result);
+                    request.onerror = () => reject(request.error);
+                });
+            }
+            return queueDb;
+        }
+        
+        async function queueStore(mode, action, stores = ['pendingBills']) {
+            const db = await openQueue();
+            return new Promise((resolve, reject) => {
+                const tx = db.transaction(stores, mode);
+                const request = action(...stores.map(name => tx.objectStore(name)));
+                tx.oncomplete = () => resolve(request ? request.result : undefined);
+                tx.onerror = () => reject(tx.error);
+            });
+        }
+        
+        function queueBill(bill) {
+            return queueStore('readwrite', store => store.put(bill));
+        }
+        
+        function pendingBills() {
+            return queueStore('readonly', store => store.getAll());
+        }
+        
+        function removeQueuedBills(ids) {
+            return queueStore('readwrite', store => { ids.forEach(id => store.delete(id)); });
+        }
+        
+        function failedBills() {
+            return queueStore('readonly', store => store.getAll(), ['failedBills']);
+        }
+        
+        function setAsideBills(batch, rejected) {
+            // Resending a rejected bill cannot succeed, so keep it aside for review
+            const errors = new Map(rejected.map(r => [r.bill_id, r.error]));
+            return queueStore('readwrite', (pending, failed) => {
+                batch.filter(bill => errors.has(bill.bill_id)).forEach(bill => {
+                    failed.put({...bill, error: errors.get(bill.bill_id)});
+                    pending.delete(bill.bill_id);
+                });
+            }, ['pendingBills', 'failedBills']);
+        }
+        
+        async function syncBills() {
+            if (syncing) return;
+            syncing = true;
+            try {
+                const pending = await pendingBills();
+                for (let i = 0; i < pending.length; i += 50) {
+                    const batch = pending.slice(i, i + 50);
+                    const response = await fetch('/api/bills/sync', {
+                        method: 'POST',
+                        headers: {'Content-Type': 'application/json'},
+                        body: JSON.stringify({bills: batch})
+                    });
+                    if (!response.ok) break;
+                    const result = await response.json();
+                    if (result.error) break;
+                    // Duplicates were saved by an earlier attempt whose reply was lost
+                    await removeQueuedBills(result.accepted.concat(result.duplicates));
+                    result.rejected.forEach(r => console.error('Bill rejected by server:', r));
+                    await setAsideBills(batch, result.rejected);
+                }
+            } catch (error) {
+                console.log('Bill sync deferred:', error);
+            } finally {
+                syncing = false;
+                updateSyncStatus();
+            }
+        }
+        
+        async function updateSyncStatus() {
+            const [pending, failed] = await Promise.all([pendingBills(), failedBills()]);
+            const status = pending.length
+                ? `${pending.length} bill(s) waiting to sync`
+                : 'All bills synced';
+            document.getElementById('syncStatus').textContent = failed.length
+                ? `${status}, ${failed.length} rejected by the server`
+                : status;
         }
         
         async function loadBillHistory() {
             const response = await fetch('/api/bills');
-            const bills = await response.json();
+            bills = await response.json();
+            billsLoaded = true;
+            if (!searching) renderBillHistory();
+        }
+        
+        async function searchBills(page) {
+            const text = document.getElementById('billSearch').value.trim();
+            const pager = document.getElementById('searchPager');
+            if (!text) {
+                searching = false;
+                pager.innerHTML = '';
+                loadBillHistory();
+                return;
+            }
+            
+            const response = await fetch(`/api/bills/search?q=${encodeURIComponent(text)}&page=${page}`);
+            const result = await response.json();
+            searching = true;
+            renderBillHistory(result.results || []);
             
+            pager.innerHTML = '';
+            if (page > 1) {
+                pager.innerHTML += `<button onclick="searchBills(${page - 1})">Previous</button>`;
+            }
+            if (result.has_more) {
+                pager.innerHTML += `<button onclick="searchBills(${page + 1})">Next</button>`;
+            }
+        }
+        
+        function exportBills() {
+            const from = document.getElementById('exportFrom').value;
+            const to = document.getElementById('exportTo').value;
+            if (!from || !to) {
+                alert('Please choose both dates');
+                return;
+            }
+            window.location = `/api/bills/archive?from=${from}&to=${to}`;
+        }
+        
+        function renderBillHistory(rows = bills) {
             const historyDiv = document.getElementById('billsHistory');
-            if (bills.length === 0) {
+            if (rows.length === 0) {
                 historyDiv.innerHTML = '<p>No bills found</p>';
                 return;
             }
             
             let html = '';
-            bills.forEach(bill => {
+            rows.forEach(bill => {
                 html += `<div class="bill-record">
                     <div>
                         <strong>${bill[0]}</strong><br>
@@ -773,16 +2239,91 @@ Visit: rakshanacrackers.com
             historyDiv.innerHTML = html;
         }
         
+        function connectEvents() {
+            if (!window.EventSource) {
+                loadCart();
+                return;
+            }
+            
+            // Cart changes and new bills from every counter are pushed here,
+            // the first 'cart' event carries the full cart. Changes this page
+            // made itself are already applied and are skipped.
+            const source = new EventSource('/api/events');
+            const fromElsewhere = data => data.origin !== clientId;
+            source.onopen = () => {
+                // Catch up on bills missed while disconnected
+                if (billsLoaded) loadBillHistory();
+                syncBills();
+            };
+            
+            source.addEventListener('cart', e => {
+                if (cartDirty) {
+                    pushLocalCart();
+                    return;
+                }
+                cart = JSON.parse(e.data);
+                renderCart();
+            });
+            source.addEventListener('cart-add', e => {
+                const data = JSON.parse(e.data);
+                if (!fromElsewhere(data)) return;
+                cart.push(data);
+                renderCart();
+            });
+            source.addEventListener('cart-remove', e => {
+                const data = JSON.parse(e.data);
+                if (!fromElsewhere(data)) return;
+                cart.splice(data.index, 1);
+                renderCart();
+            });
+            source.addEventListener('cart-clear', e => {
+                if (!fromElsewhere(JSON.parse(e.data))) return;
+                cart = [];
+                renderCart();
+            });
+            source.addEventListener('bill', e => {
+                if (!billsLoaded) return;
+                bills.unshift(JSON.parse(e.data));
+                bills = bills.slice(0, 50);
+                // Leave search results on screen until the search is cleared
+                if (!searching) renderBillHistory();
+            });
+        }
+        
         // Initialize
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.register('/sw.js').catch(error => console.log('Service worker not registered:', error));
+        }
         loadInventory();
-        loadCart();
+        connectEvents();
+        updateSyncStatus();
+        window.addEventListener('online', syncBills);
+        setInterval(syncBills, 30000);
     </script>
 </body>
 </html>'''
 
+class BillingHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Connections are accepted straight away and shed by the admission queue,
+    # so the kernel backlog only absorbs accept() bursts. Keep it at
+    # socketserver's default of 5 so a stalled process refuses connections
+    # quickly instead of leaving browsers to time out.
+    request_queue_size = int(os.environ.get('LISTEN_BACKLOG', 5))
+    startup_ms = None
+
 def run_server():
     port = int(os.environ.get('PORT', 8080))
-    server = HTTPServer(('0.0.0.0', port), CrackerBillingHandler)
+    server = BillingHTTPServer(('0.0.0.0', port), CrackerBillingHandler)
+    
+    server.startup_ms = round((time.monotonic() - BOOT_TIME) * 1000, 1)
+    target_ms = float(os.environ.get('STARTUP_TARGET_MS', 500))
+    print(f"Cold start: listening after {server.startup_ms}ms (target {target_ms:.0f}ms)")
+    if server.startup_ms > target_ms:
+        print("Warning: cold start exceeded target")
+    
+    # Connect and migrate in the background; /healthz reports when ready
+    threading.Thread(target=CrackerBillingHandler.db.ensure_ready, daemon=True).start()
     print("*** RAKSHANA CRACKERS GST BILLING SYSTEM ***")
     print("Features: GST Calculation + Database Storage")
     print(f"Server running on port {port}")
@@ -0,0 +1,236 @@
+"""
+BillingDatabase parity tests for SQLite and PostgreSQL.
+
+The PostgreSQL cases run against a local server named by TEST_DATABASE_URL,
+e.g. postgresql://postgres@localhost/billing_test, and are skipped without it.
+Its bills, bill_items and schema_version tables are dropped before each test.
+"""
+
+import json
+import os
+import threading
+
+import pytest
+
+import enhanced_billing
+from enhanced_billing import BillingDatabase, PostgresDialect, MIGRATIONS
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+
+def reset_postgres(url):
+    import psycopg2
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    conn.cursor().execute('DROP TABLE IF EXISTS bill_items, bills, schema_version CASCADE')
+    conn.close()
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def db(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    if request.param == 'postgres':
+        if not TEST_DATABASE_URL:
+            pytest.skip('TEST_DATABASE_URL not set')
+        reset_postgres(TEST_DATABASE_URL)
+        monkeypatch.setenv('DATABASE_URL', TEST_DATABASE_URL)
+    else:
+        monkeypatch.delenv('DATABASE_URL', raising=False)
+    database = BillingDatabase()
+    yield database
+    while not database._pool.empty():
+        database._pool.get_nowait().close()
+
+
+def make_bill(bill_no, date, name='Ramesh Kumar', phone='9876543210', client_id=None):
+    items = [
+        {"product": "Baby Rocket", "qty": 3, "price": 8},
+        {"product": "Flower Pot Big", "qty": 1, "price": 45},
+    ]
+    bill_data = {
+        'bill_no': bill_no, 'date': date, 'customer_name': name,
+        'customer_phone': phone, 'customer_address': 'Sivakasi Main Road',
+        'subtotal': 69.0, 'cgst': 6.21, 'sgst': 6.21, 'total_amount': 81.42,
+    }
+    if client_id:
+        bill_data['client_id'] = client_id
+    return bill_data, items
+
+
+def test_migrations_apply_once(db):
+    assert db.ensure_ready()
+    assert db.schema_version == MIGRATIONS[-1][0]
+
+    again = BillingDatabase()
+    assert again.ensure_ready()
+    assert again.schema_version == db.schema_version
+
+
+def test_failed_migration_is_rolled_back_whole(db, monkeypatch):
+    assert db.ensure_ready()
+    add_note = 'ALTER TABLE bills ADD COLUMN note TEXT'
+    broken = (5, 'add note', {'sqlite': [add_note, 'SELECT * FROM missing'],
+                              'postgres': [add_note, 'SELECT * FROM missing']})
+    monkeypatch.setattr(enhanced_billing, 'MIGRATIONS', MIGRATIONS + [broken])
+    assert not BillingDatabase().ensure_ready()
+
+    # The column added before the failure must not survive, or the rerun would fail
+    fixed = (5, 'add note', {'sqlite': [add_note], 'postgres': [add_note]})
+    monkeypatch.setattr(enhanced_billing, 'MIGRATIONS', MIGRATIONS + [fixed])
+    again = BillingDatabase()
+    assert again.ensure_ready()
+    assert again.schema_version == 5
+
+
+def test_save_and_get_bills(db):
+    assert db.save_bill(*make_bill('RPP20251001100000', '2025-10-01 10:00:00'))
+    assert db.save_bill(*make_bill('RPP20251002100000', '2025-10-02 10:00:00', name='Lakshmi'))
+
+    bills = db.get_bills()
+    assert bills == [
+        ['RPP20251002100000', '2025-10-02 10:00:00', 'Lakshmi', '9876543210', 81.42],
+        ['RPP20251001100000', '2025-10-01 10:00:00', 'Ramesh Kumar', '9876543210', 81.42],
+    ]
+    # Rows must be JSON serialisable for /api/bills
+    json.dumps(bills)
+
+    # Second call reuses the prepared statement on a pooled connection
+    assert db.get_bills(limit=1) == bills[:1]
+
+
+def test_save_bill_rejects_duplicate_bill_no(db):
+    assert db.save_bill(*make_bill('RPP1', '2025-10-01 10:00:00'))
+    assert not db.save_bill(*make_bill('RPP1', '2025-10-01 10:00:00'))
+    assert len(db.get_bills()) == 1
+
+
+def test_save_bills_deduplicates_by_client_id(db):
+    first = [make_bill('RPP-A', '2025-10-01 10:00:00', client_id='a'),
+             make_bill('RPP-B', '2025-10-01 10:01:00', client_id='b')]
+    assert db.save_bills(first) == (['a', 'b'], [], [])
+
+    again = [make_bill('RPP-B', '2025-10-01 10:01:00', client_id='b'),
+             make_bill('RPP-C', '2025-10-01 10:02:00', client_id='c')]
+    assert db.save_bills(again) == (['c'], ['b'], [])
+    assert len(db.get_bills()) == 3
+
+
+def test_save_bills_isolates_a_failing_bill(db):
+    db.save_bill(*make_bill('RPP-TAKEN', '2025-10-01 09:00:00'))
+
+    batch = [make_bill('RPP-A', '2025-10-01 10:00:00', client_id='a'),
+             make_bill('RPP-TAKEN', '2025-10-01 10:01:00', client_id='b'),
+             make_bill('RPP-C', '2025-10-01 10:02:00', client_id='c')]
+    assert db.save_bills(batch) == (['a', 'c'], [], ['b'])
+
+    assert sorted(bill[0] for bill in db.get_bills()) == ['RPP-A', 'RPP-C', 'RPP-TAKEN']
+    assert len(db.search_bills('flower')[0]) == 3
+    # Line items are stored once per saved bill, none for the failed one
+    pages = list(db.iter_bill_pages('2025-10-01', '2025-10-02'))
+    assert [len(items) for page in pages for _, items in page] == [2, 2, 2]
+
+
+def test_save_bills_reports_a_concurrent_save_as_duplicate(db, monkeypatch):
+    db.save_bills([make_bill('RPP-B', '2025-10-01 10:01:00', client_id='b')])
+
+    # Simulate another tab saving bill b between the duplicate check and the insert
+    sql = db.dialect.sql
+    monkeypatch.setattr(db.dialect, 'sql', lambda query: sql(
+        query.replace('WHERE client_id IN', 'WHERE 1 = 0 AND client_id IN')))
+    batch = [make_bill('RPP-A', '2025-10-01 10:00:00', client_id='a'),
+             make_bill('RPP-B', '2025-10-01 10:01:00', client_id='b')]
+    assert db.save_bills(batch) == (['a'], ['b'], [])
+
+
+def test_concurrent_save_bills_all_succeed(db):
+    def batch(n):
+        return [make_bill(f'RPP-{n}-{i}', '2025-10-01 10:00:00', client_id=f'{n}-{i}')
+                for i in range(50)]
+
+    results = {}
+    threads = [threading.Thread(target=lambda n=n: results.update({n: db.save_bills(batch(n))}))
+               for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(len(saved) == 50 and not failed for saved, _, failed in results.values())
+    assert len(results) == 4
+    assert len(db.get_bills(limit=500)) == 200
+
+
+def test_search_bills(db):
+    db.save_bill(*make_bill('RPP20251001100000', '2025-10-01 10:00:00'))
+    db.save_bill(*make_bill('RPP20251002100000', '2025-10-02 10:00:00',
+                            name='Lakshmi Devi', phone='9123456789'))
+
+    rows, has_more = db.search_bills('lakshmi')
+    assert [row[0] for row in rows] == ['RPP20251002100000']
+    assert not has_more
+
+    # Partial phone number and bill number prefixes
+    assert [row[0] for row in db.search_bills('98765')[0]] == ['RPP20251001100000']
+    assert len(db.search_bills('RPP2025100')[0]) == 2
+
+    # Product names from the line items are indexed too
+    assert len(db.search_bills('flower')[0]) == 2
+
+    rows, has_more = db.search_bills('RPP2025100', page=1, per_page=1)
+    assert len(rows) == 1 and has_more
+    rows, has_more = db.search_bills('RPP2025100', page=2, per_page=1)
+    assert len(rows) == 1 and not has_more
+
+    assert db.search_bills('   ') == ([], False)
+
+
+def test_iter_bill_pages(db):
+    for day in range(1, 6):
+        db.save_bill(*make_bill(f'RPP202510{day:02d}', f'2025-10-{day:02d} 12:00:00'))
+
+    pages = list(db.iter_bill_pages('2025-10-02', '2025-10-05', page_size=2))
+    assert [len(page) for page in pages] == [2, 1]
+
+    bills = [bill for page in pages for bill in page]
+    assert [bill['bill_no'] for bill, _ in bills] == ['RPP20251002', 'RPP20251003', 'RPP20251004']
+
+    bill_data, items = bills[0]
+    assert bill_data['date'] == '2025-10-02 12:00:00'
+    assert bill_data['total_amount'] == 81.42
+    assert items == [
+        {"product": "Baby Rocket", "qty": 3, "price": 8},
+        {"product": "Flower Pot Big", "qty": 1, "price": 45},
+    ]
+
+
+def test_postgres_sql_translation():
+    dialect = PostgresDialect('postgresql://localhost/unused')
+    assert dialect.sql("SELECT * FROM t WHERE a LIKE '5%' AND b = ?") == \
+        "SELECT * FROM t WHERE a LIKE '5%%' AND b = %s"
+    assert dialect.numbered('SELECT ? , ?') == 'SELECT $1 , $2'
+
+
+def test_postgres_insert_returning_translates_once():
+    executed = []
+
+    class Cursor:
+        def execute(self, query, params):
+            # psycopg2 formats parameters with the % operator
+            executed.append(query % tuple(repr(param) for param in params))
+
+        def fetchone(self):
+            return (42,)
+
+    dialect = PostgresDialect('postgresql://localhost/unused')
+    bill_id = dialect.insert_returning(Cursor(), 'INSERT INTO t (a, b) VALUES (?, ?)', (1, 'x'))
+    assert bill_id == 42
+    assert executed == ["INSERT INTO t (a, b) VALUES (1, 'x') RETURNING id"]
+
+
+def test_sqlite_is_used_without_database_url(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    database = BillingDatabase()
+    assert database.ensure_ready()
+    assert database.dialect.name == 'sqlite'
+    assert (tmp_path / enhanced_billing.SQLITE_PATH).exists()
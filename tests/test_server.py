@@ -0,0 +1,339 @@
+"""
+HTTP tests against a live BillingHTTPServer on SQLite in a temporary directory.
+"""
+
+import io
+import json
+import re
+import shutil
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+
+import pytest
+
+import enhanced_billing
+from enhanced_billing import (
+    AdmissionController, BillingDatabase, BillingHTTPServer, CartLine, CrackerBillingHandler, EventHub
+)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.setattr(CrackerBillingHandler, 'db', BillingDatabase())
+    monkeypatch.setattr(CrackerBillingHandler, 'profiler', enhanced_billing.RequestProfiler())
+    monkeypatch.setattr(CrackerBillingHandler, 'cart', [])
+
+    httpd = BillingHTTPServer(('127.0.0.1', 0), CrackerBillingHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url, headers=None):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as response:
+        return json.loads(response.read())
+
+
+def post(url, data):
+    body = data if isinstance(data, bytes) else json.dumps(data).encode()
+    with urllib.request.urlopen(urllib.request.Request(url, data=body)) as response:
+        return json.loads(response.read())
+
+
+def test_profile_rejects_bad_input(server):
+    assert 'error' in get(f'{server}/admin/profile?limit=abc')
+    assert 'error' in post(f'{server}/admin/profile', {"sample_rate": "fast"})
+    assert 'error' in post(f'{server}/admin/profile', {"sample_rate": None})
+    assert 'error' in post(f'{server}/admin/profile', [1])
+
+    assert post(f'{server}/admin/profile', {"sample_rate": 5})["sample_rate"] == 1.0
+
+
+def test_profile_buckets_unknown_paths(server):
+    for path in ('/nope/1', '/nope/2'):
+        # Unknown paths get no response body; only the profile bucket matters
+        with pytest.raises(Exception):
+            get(f'{server}{path}', headers={'X-Profile': '1'})
+    get(f'{server}/api/cart', headers={'X-Profile': '1'})
+    routes = get(f'{server}/admin/profile')['routes']
+    assert set(routes) == {'other', '/api/cart'}
+    assert routes['other']['requests'] == 2
+
+
+def test_product_ids_are_explicit_and_unique():
+    ids = [details["id"] for details in CrackerBillingHandler.inventory.values()]
+    assert len(set(ids)) == len(ids)
+    assert CrackerBillingHandler.product_names[23] == "Safety Matches"
+
+
+def test_cart_prices_come_from_catalog(server):
+    assert post(f'{server}/api/add-item', {"product_id": 12, "qty": 2, "price": 0})["success"]
+    assert post(f'{server}/api/add-item', {"product": "Safety Matches", "qty": 1})["success"]
+    assert 'error' in post(f'{server}/api/add-item', {"product_id": 999, "qty": 1})
+
+    cart = get(f'{server}/api/cart')
+    assert [(line["product"], line["price"], line["qty"]) for line in cart] == [
+        ("Baby Rocket", 8, 2), ("Safety Matches", 5, 1)
+    ]
+    assert get(f'{server}/api/inventory')["Baby Rocket"] == {"id": 12, "price": 8, "gst": 18}
+
+
+def test_cart_rejects_malformed_input(server):
+    assert 'error' in post(f'{server}/api/add-item', [12, 1])
+    assert 'error' in post(f'{server}/api/remove-item', {"index": "first"})
+    assert 'error' in post(f'{server}/api/remove-item', [0])
+
+    post(f'{server}/api/add-item', {"product_id": 12, "qty": 1})
+    assert post(f'{server}/api/remove-item', {"index": 0})["success"]
+    assert get(f'{server}/api/cart') == []
+
+
+def test_sync_rejects_bad_bills_and_saves_the_rest(server):
+    def bill(bill_id, customer):
+        return {"bill_id": bill_id, "bill_no": f"RPP-{bill_id}", "date": "2025-10-01 10:00:00",
+                "customer": customer, "items": [{"product_id": 12, "qty": 2}]}
+
+    result = post(f'{server}/api/bills/sync', {"bills": [
+        bill("ok", {"name": "  Lakshmi ", "phone": 9876543210, "address": "x" * 1000}),
+        bill("bad", {"name": ["not", "text"]}),
+        bill("walk-in", None),
+    ]})
+    assert result == {"accepted": ["ok", "walk-in"], "duplicates": [],
+                      "rejected": [{"bill_id": "bad", "error": "Invalid bill"}]}
+
+    # A bill number already used by another till is rejected, not retried forever
+    result = post(f'{server}/api/bills/sync', {"bills": [bill("other", {"name": "Ravi"})]})
+    assert result["rejected"] == []
+    clash = dict(bill("clash", {}), bill_no="RPP-other")
+    result = post(f'{server}/api/bills/sync', {"bills": [clash]})
+    assert result == {"accepted": [], "duplicates": [],
+                      "rejected": [{"bill_id": "clash", "error": "Could not save bill"}]}
+
+    bills = {row[0]: row for row in get(f'{server}/api/bills')}
+    assert bills["RPP-ok"][2:4] == ["Lakshmi", "9876543210"]
+    assert bills["RPP-walk-in"][2] == "Walk-in Customer"
+    assert 'error' in post(f'{server}/api/generate-bill', {"name": {"first": "Ravi"}})
+
+
+def test_sync_requires_an_object_and_string_bill_ids(server):
+    assert 'error' in post(f'{server}/api/bills/sync', [1])
+
+    bill = {"bill_no": "RPP-1", "date": "2025-10-01 10:00:00", "customer": {},
+            "items": [{"product_id": 12, "qty": 1}]}
+    result = post(f'{server}/api/bills/sync', {"bills": [dict(bill, bill_id=None), dict(bill, bill_id=7)]})
+    assert result["accepted"] == []
+    assert result["rejected"] == [{"bill_id": None, "error": "Invalid bill"}] * 2
+
+
+def test_gst_rounds_half_paise_up():
+    handler = CrackerBillingHandler.__new__(CrackerBillingHandler)
+    # Safety Matches x1: Rs.5 at 2.5% is 12.5 paise
+    assert handler.calculate_gst(5, 2.5) == 0.13
+    assert handler.calculate_gst(15, 2.5) == 0.38
+    assert handler.calculate_gst(45, 9) == 4.05
+
+
+@pytest.mark.skipif(not shutil.which('node'), reason='node not installed')
+def test_page_bill_matches_server_bill():
+    handler = CrackerBillingHandler.__new__(CrackerBillingHandler)
+    script = re.search(r'function calculateGst.*?(?=async function generateBill)',
+                       handler.get_html(), re.S).group(0)
+    customer = {"name": "Lakshmi", "phone": "9876543210", "address": "Sivakasi"}
+    carts = [[(23, 1)], [(23, 3), (12, 7)], [(product_id, product_id + 1) for product_id in range(24)]]
+
+    for cart in carts:
+        items = [handler.resolve_line(CartLine(product_id, qty)) for product_id, qty in cart]
+        expected, _ = handler.generate_bill(customer, items, 'RPP1', '2025-10-01 10:00:00')
+        call = f"formatBill('RPP1', '2025-10-01 10:00:00', {json.dumps(customer)}, {json.dumps(items)})"
+        result = subprocess.run(['node', '-e', f'{script}\nprocess.stdout.write({call});'],
+                                capture_output=True, text=True, check=True)
+        assert result.stdout == expected
+
+
+def test_search_clamps_page(server):
+    result = get(f'{server}/api/bills/search?q=ramesh&page=100000000000000000000')
+    assert (result["page"], result["results"], result["has_more"]) == (10000, [], False)
+    assert 'error' in get(f'{server}/api/bills/search?q=ramesh&page=two')
+
+
+def test_health_does_not_wait_for_a_connection_attempt(server):
+    db = CrackerBillingHandler.db
+    # Another thread is connecting and migrating
+    with db._ready_lock:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            get(f'{server}/healthz')
+    assert error.value.code == 503
+    assert json.loads(error.value.read())["status"] == "unavailable"
+
+    assert get(f'{server}/healthz')["status"] == "ok"
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def admission(max_active=1, queue_size=32, queue_timeout=2.0):
+    controller = AdmissionController()
+    controller.max_active = max_active
+    controller.queue_size = queue_size
+    controller.queue_timeout = queue_timeout
+    return controller
+
+
+def test_admission_admits_waiting_checkout_first():
+    controller = admission()
+    assert controller.acquire('counter') is not None
+    order = []
+
+    def request(name):
+        assert controller.acquire(name) is not None
+        order.append(name)
+        controller.release(name)
+
+    threads = []
+    # Queued lowest priority first, so arrival order does not decide
+    for name in ('history', 'counter', 'checkout'):
+        threads.append(threading.Thread(target=request, args=(name,)))
+        threads[-1].start()
+        wait_for(lambda: controller.waiting[name] == 1)
+
+    controller.release('counter')
+    for thread in threads:
+        thread.join()
+    assert order == ['checkout', 'counter', 'history']
+    assert controller.snapshot()['classes']['checkout']['admitted'] == 1
+
+
+def test_admission_per_class_limit_sheds_after_timeout():
+    controller = admission(max_active=16, queue_timeout=0.05)
+    assert controller.acquire('history') is not None
+    assert controller.acquire('history') is not None
+    # History is capped at 2 concurrent requests; counter is unaffected
+    assert controller.acquire('history') is None
+    assert controller.acquire('counter') is not None
+    assert controller.snapshot()['classes']['history']['shed'] == 1
+
+    controller.release('history')
+    assert controller.acquire('history') is not None
+
+
+def test_admission_sheds_lower_priorities_from_a_smaller_queue_share():
+    controller = admission(queue_size=4)
+    controller.acquire('checkout')
+    waiter = threading.Thread(target=controller.acquire, args=('checkout',))
+    waiter.start()
+    wait_for(lambda: controller.waiting['checkout'] == 1)
+
+    # History may use 4 >> 2 = 1 queue slot, which is taken, so it is shed at once
+    started = time.monotonic()
+    assert controller.acquire('history') is None
+    assert time.monotonic() - started < 0.5
+    assert controller.snapshot()['classes']['history']['shed'] == 1
+
+    controller.release('checkout')
+    waiter.join()
+
+
+def test_busy_server_answers_503_with_retry_after(server, monkeypatch):
+    controller = admission(max_active=0, queue_timeout=0.01)
+    monkeypatch.setattr(CrackerBillingHandler, 'admission', controller)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        get(f'{server}/api/cart')
+    assert error.value.code == 503
+    assert error.value.headers['Retry-After'] == str(controller.retry_after)
+    assert 'error' in json.loads(error.value.read())
+
+
+def test_event_hub_drops_a_slow_subscriber():
+    hub = EventHub()
+    hub.queue_size = 2
+    slow, fast = hub.subscribe(), hub.subscribe()
+
+    for n in range(3):
+        hub.publish('cart-add', {"n": n})
+        assert fast.get_nowait() == f'event: cart-add\ndata: {{"n": {n}}}\n\n'.encode()
+
+    # The slow subscriber's backlog is discarded and its stream told to close
+    assert hub.subscribers == {fast}
+    assert hub.dropped == 1
+    assert slow.get_nowait() is None
+    assert slow.empty()
+
+
+def read_event(stream):
+    lines = []
+    while True:
+        line = stream.readline().decode().rstrip('\n')
+        if not line:
+            return lines
+        lines.append(line)
+
+
+def test_event_stream_sends_snapshot_then_changes(server, monkeypatch):
+    monkeypatch.setattr(CrackerBillingHandler, 'events', EventHub())
+    post(f'{server}/api/add-item', {"product_id": 23, "qty": 1})
+
+    with urllib.request.urlopen(f'{server}/api/events', timeout=5) as stream:
+        assert stream.headers['Content-Type'] == 'text/event-stream'
+        retry, event, data = read_event(stream)
+        assert (retry, event) == ('retry: 3000', 'event: cart')
+        assert [line["product"] for line in json.loads(data[len('data: '):])] == ["Safety Matches"]
+
+        request = urllib.request.Request(f'{server}/api/add-item', headers={'X-Client-Id': 'tab-1'},
+                                         data=json.dumps({"product_id": 12, "qty": 2}).encode())
+        urllib.request.urlopen(request).close()
+        event, data = read_event(stream)
+        assert event == 'event: cart-add'
+        line = json.loads(data[len('data: '):])
+        assert (line["product"], line["qty"], line["origin"]) == ("Baby Rocket", 2, "tab-1")
+
+
+def test_archive_download(server, tmp_path):
+    synced = {"bill_id": "tab-1", "bill_no": "RPP-SYNCED", "date": "2025-10-02 09:30:00",
+              "customer": {"name": "Lakshmi"}, "items": [{"product_id": 23, "qty": 1}]}
+    assert post(f'{server}/api/bills/sync', {"bills": [synced]})["accepted"] == ["tab-1"]
+    # The stored file is what goes in the archive, not a fresh rendering
+    stored = tmp_path / 'bill_RPP-SYNCED.txt'
+    stored.write_text(stored.read_text() + '\nPrinted at counter 2')
+
+    handler = CrackerBillingHandler.__new__(CrackerBillingHandler)
+    items = [handler.resolve_line(CartLine(12, 4))]
+    _, bill_data = handler.generate_bill({"name": "Ravi"}, items, 'RPP-SERVER', '2025-10-03 18:00:00')
+    assert CrackerBillingHandler.db.save_bill(bill_data, items)
+    # Outside the range
+    _, early = handler.generate_bill({}, items, 'RPP-EARLY', '2025-09-30 23:59:59')
+    assert CrackerBillingHandler.db.save_bill(early, items)
+
+    with urllib.request.urlopen(f'{server}/api/bills/archive?from=2025-10-01&to=2025-10-31') as response:
+        assert response.headers['Transfer-Encoding'] == 'chunked'
+        assert response.headers['Content-Type'] == 'application/zip'
+        body = response.read()
+
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['RPP-SYNCED.txt', 'RPP-SERVER.txt']
+        assert archive.read('RPP-SYNCED.txt').decode() == stored.read_text()
+        rendered = archive.read('RPP-SERVER.txt').decode()
+        assert 'Customer: Ravi' in rendered and 'Baby Rocket' in rendered
+        assert archive.getinfo('RPP-SERVER.txt').date_time == (2025, 10, 3, 18, 0, 0)
+
+
+def test_archive_rejects_bad_ranges(server):
+    for query in ('from=2025-10-01', 'from=2025-13-01&to=2025-10-31',
+                  'from=2025-10-31&to=2025-10-01', 'from=2024-01-01&to=2025-01-02'):
+        assert 'error' in get(f'{server}/api/bills/archive?{query}')
+    with urllib.request.urlopen(f'{server}/api/bills/archive?from=2024-01-01&to=2025-01-01') as response:
+        with zipfile.ZipFile(io.BytesIO(response.read())) as archive:
+            assert archive.namelist() == []